@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Reconstruction of starshape arms from their mirror images across the vxB axis.
+#
+# In the vxB, vxvxB plane the geomagnetic emission is polarised along vxB and the charge excess emission radially.
+# An antenna at (x, -y) therefore sees the same field as the antenna at (x, y) with the vxvxB component negated:
+# energy fluences and amplitudes are the same, the vxvxB components of traces and polarisation vectors and the
+# Stokes parameters U and V change sign. Simulations made with create_stshp_list(..., reduced_arms=True)
+# contain only the arms in [0, 180] degrees, the other arms are reconstructed here from the _highlevel.hdf5 file.
+#
+# The symmetry is exact for showerplane starshapes of an ideal footprint. For groundplane starshapes the
+# mirrored antennas are at a different distance to the shower maximum (early-late effect), use --validate on
+# a simulation with all arms to check the accuracy for your geometries.
+
+import numpy as np
+import h5py
+from optparse import OptionParser
+import sys
+
+from utils.coordtransform import cstransform, spherical_to_cartesian
+
+
+parser = OptionParser()
+parser.add_option("--file", "-f", type="str", dest="file", metavar="FILE",
+                  help="Specify the path to the _highlevel.hdf5 file.")
+parser.add_option("--out", "-o", type="str", dest="out", metavar="FILE",
+                  help="Path of the _highlevel.hdf5 file with the reconstructed arms "
+                       "(default: input file name with _mirrored).")
+parser.add_option("--validate", action="store_true", dest="validate", default=False,
+                  help="Do not write a file, but compare the mirrored arms to the simulated arms of a simulation with all arms.")
+
+# quantities of the observation planes which are the same for mirrored antennas
+symmetric_keys = ["energy_fluence_vector", "energy_fluence", "amplitude", "amplitude_total",
+                  "frequency_slope", "times_filtered", "slicing_boundaries"]
+
+
+def get_obsplane_transform(f_h5_hl):
+    """ returns the cstransform of the highlevel group (same definition as in coreas_to_hdf5_mods.py) """
+    magnetic_field_vector = spherical_to_cartesian(f_h5_hl.attrs["magnetic_field_inclination"] + np.pi / 2,
+                                                   f_h5_hl.attrs["magnetic_field_declination"] + np.pi * 0.5)
+    return cstransform(f_h5_hl.attrs["zenith"], f_h5_hl.attrs["azimuth"], magnetic_field_vector=magnetic_field_vector)
+
+
+def get_obsplane_core(core, obsplanename):
+    """
+    Returns the core (in m) of an observation plane obsplane_<obslevel>_<plane>_<polarisation>. The antenna names
+    of starshapes.py contain the observation level in cm (as in CORSIKA), while coreas_to_hdf5_mods.py stores
+    it as m in the dataset "core" (and computes antenna_position_vBvvB relative to that point). The height is
+    therefore taken from the name of the plane, converted to m. Planes without a numeric level keep the stored core.
+    """
+    core = np.array(core, dtype=float)
+    try:
+        core[2] = float(obsplanename.split("_")[1]) * 1e-2  # conversion to m
+    except (IndexError, ValueError):
+        pass
+    return core
+
+
+def get_mirror_partners(positions_vBvvB, tolerance=1e-3):
+    """
+    Returns for each antenna the index of the antenna at the mirrored position (x, -y) in the vxB, vxvxB plane,
+    or -1 if there is none. Positions agree if they differ by less than tolerance times the axis distance (plus 1 mm).
+    """
+    xy = np.asarray(positions_vBvvB)[:, :2]
+    mirrored = xy * np.array([1, -1])
+    distances = np.linalg.norm(mirrored[:, np.newaxis] - xy[np.newaxis], axis=-1)
+    radius = np.linalg.norm(xy, axis=-1)
+
+    partners = np.argmin(distances, axis=1)
+    partners[distances[np.arange(len(xy)), partners] > tolerance * radius + 1e-3] = -1
+    return partners
+
+
+def mirror_name(name):
+    """ name of the mirrored antenna, for names like pos_<ring>_<arm>_... the arm angle is mirrored """
+    if isinstance(name, bytes):
+        name = name.decode("utf-8")
+    parts = name.split("_")
+    try:
+        parts[2] = "%i" % ((360 - int(parts[2])) % 360)
+        return "_".join(parts)
+    except (IndexError, ValueError):
+        return name + "_mirrored"
+
+
+def mirror_quantities(data, index):
+    """
+    Returns the quantities of the mirrored antennas.
+
+    Parameters
+    ----------
+    data :  dict with the datasets of an observation plane (vxB, vxvxB, v polarisation)
+    index :  indices of the antennas to mirror
+
+    Returns
+    -------
+    mirrored :  dict with the same per-antenna keys as data for the mirrored antennas
+                (without positions and names)
+    """
+    mirrored = {}
+    for key in symmetric_keys:
+        if key in data:
+            mirrored[key] = data[key][index]
+
+    # components which change sign: vxvxB of vectors and traces, U and V of the stokes parameters
+    if "polarization_vector" in data:
+        mirrored["polarization_vector"] = data["polarization_vector"][index] * np.array([1, -1, 1])
+    if "traces_filtered" in data:
+        mirrored["traces_filtered"] = data["traces_filtered"][index] * np.array([1, -1, 1])
+    if "stokes_parameter" in data:
+        mirrored["stokes_parameter"] = data["stokes_parameter"][index] * np.array([1, 1, -1, -1])
+
+    return mirrored
+
+
+def mirror_positions(positions, positions_vBvvB, core, ctrans, stored_core=None):
+    """ returns the ground and vxB positions of the mirrored antennas. Antennas at the height of the core
+    (groundplane starshapes) are projected onto the ground, all others stay in the shower plane.
+    The returned vxB positions are relative to stored_core (default: core), as the ones in the highlevel file. """
+    mirrored_vBvvB = positions_vBvvB * np.array([1, -1, 1])
+
+    if np.allclose(positions[:, 2], core[2], atol=1e-3):
+        mirrored = np.atleast_2d(ctrans.transform_from_vxB_vxvxB_2D(mirrored_vBvvB, core=core))
+        mirrored[:, 2] = core[2]
+    else:
+        mirrored = np.atleast_2d(ctrans.transform_from_vxB_vxvxB(mirrored_vBvvB, core=core))
+
+    if stored_core is None:
+        stored_core = core
+    mirrored_vBvvB = np.atleast_2d(ctrans.transform_to_vxB_vxvxB(mirrored, core=stored_core))
+    return mirrored, mirrored_vBvvB
+
+
+def read_obsplane(f_h5_obsplane):
+    """ returns all datasets of an observation plane as dict of arrays """
+    return {key: f_h5_obsplane[key][...] for key in f_h5_obsplane.keys()}
+
+
+def check_polarisation(obsplanename):
+    if not obsplanename.endswith("vB_vvB"):
+        sys.exit("Mirroring needs quantities in vxB, vxvxB, v polarisation, "
+                 "but %s is in x, y, z polarisation (converted with --novB_vvB)" % obsplanename)
+
+
+def reconstruct_arms(filename, output_filename):
+    """
+    Copies a _highlevel.hdf5 file and adds the mirrored antennas of all antennas off the vxB axis which
+    have no simulated mirror partner. The added antennas are marked in the dataset "reconstructed".
+
+    Returns
+    -------
+    report :  dict with the number of simulated and reconstructed antennas per observation plane
+    """
+    report = {}
+    with h5py.File(filename, "r") as f_in, h5py.File(output_filename, "w") as f_out:
+        for key in f_in.keys():
+            if key != "highlevel":
+                f_in.copy(key, f_out)
+        for attr, value in f_in.attrs.items():
+            f_out.attrs[attr] = value
+
+        f_h5_hl = f_in["highlevel"]
+        f_h5_hl_out = f_out.create_group("highlevel")
+        for attr, value in f_h5_hl.attrs.items():
+            f_h5_hl_out.attrs[attr] = value
+
+        ctrans = get_obsplane_transform(f_h5_hl)
+
+        for obsplanename in f_h5_hl.keys():
+            check_polarisation(obsplanename)
+            f_h5_obsplane = f_h5_hl[obsplanename]
+            data = read_obsplane(f_h5_obsplane)
+
+            core = get_obsplane_core(data["core"], obsplanename)
+            positions_vBvvB = np.atleast_2d(ctrans.transform_to_vxB_vxvxB(data["antenna_position"], core=core))
+            radius = np.linalg.norm(positions_vBvvB[:, :2], axis=-1)
+            partners = get_mirror_partners(positions_vBvvB)
+            index = np.where((partners == -1) & (np.abs(positions_vBvvB[:, 1]) > 1e-3 * radius + 1e-3))[0]
+
+            mirrored = mirror_quantities(data, index)
+            mirrored["antenna_position"], mirrored["antenna_position_vBvvB"] = mirror_positions(
+                data["antenna_position"][index], positions_vBvvB[index], core, ctrans, stored_core=data["core"])
+            mirrored["antenna_names"] = np.array([np.string_(mirror_name(name)) for name in data["antenna_names"][index]])
+
+            f_h5_obsplane_out = f_h5_hl_out.create_group(obsplanename)
+            for attr, value in f_h5_obsplane.attrs.items():
+                f_h5_obsplane_out.attrs[attr] = value
+            f_h5_obsplane_out.attrs["reconstructed_from_symmetry"] = True
+
+            for key, value in data.items():
+                if key in mirrored and len(index):
+                    value = np.concatenate([value, mirrored[key].astype(value.dtype)])
+                f_h5_obsplane_out[key] = value
+            f_h5_obsplane_out["reconstructed"] = np.append(np.zeros(len(positions_vBvvB), dtype=bool),
+                                                           np.ones(len(index), dtype=bool))
+
+            # the energy of the 1D integration along the vxvxB axis is unchanged, 2D integrations over
+            # the incomplete footprint are removed
+            if "radiation_energy" in f_h5_obsplane_out.attrs:
+                del f_h5_obsplane_out.attrs["radiation_energy"]
+
+            report[obsplanename] = {"simulated": len(positions_vBvvB), "reconstructed": len(index)}
+            print("\t%s: %i simulated antennas, %i reconstructed antennas" % (obsplanename, len(positions_vBvvB), len(index)))
+
+    print("Saved highlevel file with reconstructed arms to file: ", output_filename)
+    return report
+
+
+def validate_arm_symmetry(filename):
+    """
+    Compares the antennas of the arms in (180, 360) degrees of a simulation with all arms to the mirror images
+    of their partners in (0, 180) degrees.
+
+    Returns
+    -------
+    report :  dict per observation plane with the number of compared antennas and the deviations of the
+              energy fluence and of the fluence per polarisation (relative to the maximum fluence of the plane)
+              and of the peak amplitude (relative to the local amplitude),
+              and the same per ring radius (in m) in "rings"
+    """
+    report = {}
+    with h5py.File(filename, "r") as f_in:
+        ctrans = get_obsplane_transform(f_in["highlevel"])
+        for obsplanename, f_h5_obsplane in f_in["highlevel"].items():
+            check_polarisation(obsplanename)
+            data = read_obsplane(f_h5_obsplane)
+
+            core = get_obsplane_core(data["core"], obsplanename)
+            positions_vBvvB = np.atleast_2d(ctrans.transform_to_vxB_vxvxB(data["antenna_position"], core=core))
+            radius = np.linalg.norm(positions_vBvvB[:, :2], axis=-1)
+            partners = get_mirror_partners(positions_vBvvB)
+
+            # antennas below the vxB axis are predicted from their partners above
+            index = np.where((partners != -1) & (positions_vBvvB[:, 1] < -(1e-3 * radius + 1e-3)))[0]
+            if not len(index):
+                print("\t%s: no mirrored antenna pairs found, is this a simulation with all arms?" % obsplanename)
+                continue
+
+            predicted = mirror_quantities(data, partners[index])
+            fluence = data["energy_fluence"]
+            deviation = np.abs(predicted["energy_fluence"] - fluence[index]) / np.max(fluence)
+            deviation_vector = np.abs(predicted["energy_fluence_vector"] - data["energy_fluence_vector"][index]) / np.max(fluence)
+            deviation_amplitude = np.abs(predicted["amplitude_total"] / data["amplitude_total"][index] - 1)
+
+            result = {"n_pairs": len(index),
+                      "max_fluence_deviation": float(np.max(deviation)),
+                      "mean_fluence_deviation": float(np.mean(deviation)),
+                      "max_fluence_deviation_per_polarisation": np.max(deviation_vector, axis=0).tolist(),
+                      "max_amplitude_deviation": float(np.max(deviation_amplitude))}
+
+            if "traces_filtered" in data:
+                traces = data["traces_filtered"][index]
+                result["max_trace_deviation"] = float(np.max(np.abs(predicted["traces_filtered"] - traces)) /
+                                                      np.max(np.abs(data["traces_filtered"])))
+
+            rings = np.round(radius[index], 1)
+            result["rings"] = {float(ring): float(np.max(deviation[rings == ring])) for ring in np.unique(rings)}
+            report[obsplanename] = result
+
+            print("\t%s: %i mirrored antenna pairs" % (obsplanename, len(index)))
+            print("\t\tenergy fluence deviation (relative to maximum): max %.2e, mean %.2e" % (
+                result["max_fluence_deviation"], result["mean_fluence_deviation"]))
+            print("\t\tper polarisation (vxB, vxvxB, v): max %.2e, %.2e, %.2e" % tuple(result["max_fluence_deviation_per_polarisation"]))
+            print("\t\tpeak amplitude deviation (relative): max %.2e" % result["max_amplitude_deviation"])
+            if "max_trace_deviation" in result:
+                print("\t\ttrace deviation (relative to maximum): max %.2e" % result["max_trace_deviation"])
+            print("\t\tmax fluence deviation per ring:")
+            for ring, value in result["rings"].items():
+                print("\t\t\t%10.1f m: %.2e" % (ring, value))
+
+    return report
+
+
+if __name__ == "__main__":
+    (options, args) = parser.parse_args()
+
+    if not options.file:
+        sys.exit("No highlevel file given. Quitting...")
+
+    if options.validate:
+        validate_arm_symmetry(options.file)
+    else:
+        output_filename = options.out
+        if output_filename is None:
+            output_filename = options.file.replace(".hdf5", "_mirrored.hdf5")
+        reconstruct_arms(options.file, output_filename)
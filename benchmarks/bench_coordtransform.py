@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# microbenchmarks for utils/coordtransform.py
+# run from the main directory of the package:
+#   python benchmarks/bench_coordtransform.py --out results.json
+# compare the JSON files of different releases on the same machine.
+
+import numpy as np
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.coordtransform import cstransform, spherical_to_cartesian
+
+
+parser = OptionParser()
+parser.add_option("--out", "-o", type="str", dest="out", default="bench_coordtransform.json",
+                  help="Path of the JSON file to save the results to (default: bench_coordtransform.json).")
+parser.add_option("--max-positions", type="int", dest="max_positions", default=10**7,
+                  help="Largest number of positions to benchmark, powers of ten from 1 up to this value (default: 10^7).")
+parser.add_option("--trace-lengths", type="str", dest="trace_lengths", default="256,1024,4096,16384,65536",
+                  help="Comma separated list of trace lengths for the trace benchmarks.")
+parser.add_option("--n-antennas", type="int", dest="n_antennas", default=16,
+                  help="Number of antennas in the trace benchmarks (default: 16).")
+parser.add_option("--min-time", type="float", dest="min_time", default=0.2,
+                  help="Minimum total run time per benchmark in seconds (default: 0.2).")
+parser.add_option("--filter", "-k", type="str", dest="filter", default=None,
+                  help="Only run benchmarks whose name contains this string.")
+
+
+# magnetic field in Corsika coordinates for Dunhuang
+inclination = np.deg2rad(61.60523)
+B_field = np.array([np.cos(inclination), 0, -np.sin(inclination)])
+zenith = np.deg2rad(60.)
+azimuth = np.deg2rad(30.)
+
+
+def time_function(func, min_time):
+    """ returns the best time of one call of func (in s), calls func repeatedly for at least min_time seconds """
+    best = np.inf
+    total = 0.
+    n_calls = 0
+    while total < min_time or n_calls < 3:
+        t0 = time.perf_counter()
+        func()
+        dt = time.perf_counter() - t0
+        best = min(best, dt)
+        total += dt
+        n_calls += 1
+        if n_calls >= 1000:
+            break
+    return best, n_calls
+
+
+def peak_memory(func):
+    """ returns the peak memory allocated during one call of func (in bytes) """
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def position_benchmarks(cst, n):
+    """ (name, function) pairs for n positions """
+    rng = np.random.default_rng(0)
+    positions = rng.normal(size=(n, 3)) * 1e4
+    positions_T = np.ascontiguousarray(positions.T)
+    core = np.array([100., 200., 0.])
+    zeniths = rng.uniform(0, np.pi / 2, n)
+    azimuths = rng.uniform(0, 2 * np.pi, n)
+
+    return [
+        ("spherical_to_cartesian", lambda: spherical_to_cartesian(zeniths, azimuths)),
+        ("transform_from_ground_to_onsky", lambda: cst.transform_from_ground_to_onsky(positions_T)),
+        ("transform_from_onsky_to_ground", lambda: cst.transform_from_onsky_to_ground(positions_T)),
+        ("transform_from_magnetic_to_geographic", lambda: cst.transform_from_magnetic_to_geographic(positions_T)),
+        ("transform_from_geographic_to_magnetic", lambda: cst.transform_from_geographic_to_magnetic(positions_T)),
+        ("transform_from_azimuth_to_geographic", lambda: cst.transform_from_azimuth_to_geographic(positions_T)),
+        ("transform_from_geographic_to_azimuth", lambda: cst.transform_from_geographic_to_azimuth(positions_T)),
+        ("transform_to_vxB_vxvxB", lambda: cst.transform_to_vxB_vxvxB(positions, core=core)),
+        ("transform_from_vxB_vxvxB", lambda: cst.transform_from_vxB_vxvxB(positions, core=core)),
+        ("transform_to_early_late", lambda: cst.transform_to_early_late(positions, core=core)),
+        ("transform_from_early_late", lambda: cst.transform_from_early_late(positions, core=core)),
+        ("transform_from_vxB_vxvxB_2D", lambda: cst.transform_from_vxB_vxvxB_2D(positions[:, :2], core=core)),
+        ("get_height_in_showerplane", lambda: cst.get_height_in_showerplane(positions[:, 0], positions[:, 1])),
+    ]
+
+
+def trace_benchmarks(cst, n_antennas, trace_length):
+    """ (name, function) pairs for traces with the shape (n_antennas, trace_length, 3) """
+    rng = np.random.default_rng(0)
+    traces = rng.normal(size=(n_antennas, trace_length, 3))
+    traces_inplace = traces.copy()
+    traces_32 = traces.astype(np.float32)
+
+    return [
+        ("transform_traces_to_vxB_vxvxB", lambda: cst.transform_traces_to_vxB_vxvxB(traces)),
+        ("transform_traces_from_vxB_vxvxB", lambda: cst.transform_traces_from_vxB_vxvxB(traces)),
+        ("transform_traces_to_vxB_vxvxB_inplace", lambda: cst.transform_traces_to_vxB_vxvxB(traces_inplace, inplace=True)),
+        ("transform_traces_to_vxB_vxvxB_float32", lambda: cst.transform_traces_to_vxB_vxvxB(traces_32)),
+    ]
+
+
+def run_benchmark(results, name, func, n_positions, min_time, **parameters):
+    best, n_calls = time_function(func, min_time)
+    peak = peak_memory(func)
+    result = {"name": name, "n_positions": int(n_positions), "time": best, "calls": n_calls,
+              "positions_per_second": n_positions / best if best > 0 else np.inf,
+              "peak_memory": peak}
+    result.update(parameters)
+    results.append(result)
+    print("%-40s N = %-9i %12.3e s %12.3e positions/s %10.2f MB" % (
+        name, n_positions, best, result["positions_per_second"], peak / 1024 ** 2))
+
+
+if __name__ == "__main__":
+    (options, args) = parser.parse_args()
+
+    def selected(name):
+        return options.filter is None or options.filter in name
+
+    results = []
+    cst = cstransform(zenith, azimuth, inclination=inclination, magnetic_field_vector=B_field)
+
+    # geometry-only quantities, independent of the number of positions
+    if selected("cstransform"):
+        run_benchmark(results, "cstransform", lambda: cstransform(
+            zenith, azimuth, inclination=inclination, magnetic_field_vector=B_field), 1, options.min_time)
+    if selected("get_euler_angles"):
+        run_benchmark(results, "get_euler_angles", cst.get_euler_angles, 1, options.min_time)
+
+    n = 1
+    while n <= options.max_positions:
+        for name, func in position_benchmarks(cst, n):
+            if selected(name):
+                run_benchmark(results, name, func, n, options.min_time)
+        n *= 10
+
+    for trace_length in [int(x) for x in options.trace_lengths.split(",")]:
+        for name, func in trace_benchmarks(cst, options.n_antennas, trace_length):
+            if selected(name):
+                run_benchmark(results, name, func, options.n_antennas * trace_length, options.min_time,
+                              n_antennas=options.n_antennas, trace_length=trace_length)
+
+    output = {
+        "date": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    with open(options.out, "w") as file:
+        json.dump(output, file, indent=1)
+
+    print("Saved benchmark results to file: ", options.out)
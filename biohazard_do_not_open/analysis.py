@@ -6,9 +6,9 @@ import numpy as np
 import subprocess
 from optparse import OptionParser
 import os
-from re import search
 
 from coreas_to_hdf5_mods import *
+from simulation_catalog import get_simulations
 
 # dark plots (e.g. for slides):
 # plt.style.use("dark_background")
@@ -20,33 +20,13 @@ parser.add_option("--directory", "--dir", "-d", type="str", dest="directory",
                   ")
 parser.add_option("--file", "-f", type="str", dest="file",
                   help="Specify the full path to the reas file you want to analyze.")
+parser.add_option("--catalog", "-c", type="str", dest="catalog",
+                  help="Optional: The catalog of the simulation set (see simulation_catalog.py).\
+                  Default: simulation_catalog.sqlite in the directory of the simulations.")
 
 (options, args) = parser.parse_args()
 
 
-# * * * * * * * * * * * * * *
-# * * * *  functions  * * * *
-# * * * * * * * * * * * * * *
-# read values from SIM.reas or RUN.inp
-def find_input_vals(line):
-  return search(r'[-+]?\ *[0-9]+\.?[0-9]*(?:[Ee]\ *[-+]?\ *[0-9]+)?', line)
-
-def read_params(input_file, param):
-  # works for both SIM.reas and RUN.inp, as long as you are looking for numbers
-  val = "1111"
-  with open(input_file, "r") as datafile:
-    for line in datafile:
-      if param in line:
-        line = line.lstrip()
-        if find_input_vals(line):
-          val = find_input_vals(line).group()
-          print(param, "=", val)
-          break 
-          # this is a problem for AutomaticTimeBoundaries, because it also shows up in other comments
-          # therefore, just break after the first one is found. this can definitely be improved
-  return float(val)
-# * * * * * * * * * * * * * *
-
 # GRAND freq range:
 flow = "50"
 fhigh = "200"
@@ -59,10 +39,13 @@ if __name__ == '__main__':
         reas_filename = glob.glob(options.file)[0]
         print("********************************")
         print(f"Now analyzing {reas_filename}")
-        # get zenith from inp file:
-        zenith = int(read_params(reas_filename.split(".reas")[0] + ".inp", "THETAP"))
-        # get obslevel from reas file:
-        obslevel = int(read_params(reas_filename, "CoreCoordinateVertical")) # in cm
+        # get zenith (from the inp file) and obslevel (from the reas file) from the catalog:
+        directory = os.path.dirname(os.path.abspath(reas_filename))
+        showers = get_simulations(directory, options.catalog, pattern=os.path.basename(reas_filename))
+        if os.path.abspath(reas_filename) not in showers:
+            sys.exit(f"Could not read the parameters of {reas_filename}")
+        zenith = int(showers[os.path.abspath(reas_filename)]["zenith"])
+        obslevel = int(showers[os.path.abspath(reas_filename)]["obslevel"]) # in cm
 
         # get just the path:
         path_to_reas = reas_filename.split("SIM")[-2]
@@ -102,15 +85,19 @@ if __name__ == '__main__':
         reas_names = glob.glob(options.directory + "/**" + "/SIM??????.reas") 
         # use ** if you want to go through all subdirectories, use * if you want to go only one level deeper
         print(f"Found {len(reas_names)} showers to plot!")
+        # parse the parameters of all showers once (only new or changed files are parsed again)
+        showers = get_simulations(options.directory, options.catalog, pattern="**/SIM??????.reas")
         # loop over all reas files
 
         for reas_filename in reas_names:
             print("********************************")
             print(f"Now analyzing {reas_filename}")
-            # get zenith from inp file:
-            zenith = int(read_params(reas_filename.split(".reas")[0] + ".inp", "THETAP"))
-            # get obslevel from reas file:
-            obslevel = int(read_params(reas_filename, "CoreCoordinateVertical")) # in cm
+            if os.path.abspath(reas_filename) not in showers:
+                print(f"Skipping {reas_filename}, could not read its parameters")
+                continue
+            # get zenith (from the inp file) and obslevel (from the reas file) from the catalog:
+            zenith = int(showers[os.path.abspath(reas_filename)]["zenith"])
+            obslevel = int(showers[os.path.abspath(reas_filename)]["obslevel"]) # in cm
 
             # get just the path:
             path_to_reas = reas_filename.split("SIM")[-2]
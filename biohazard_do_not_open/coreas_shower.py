@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Lazy access to CoREAS simulations, either as SIM directory (SIM??????.reas, .inp, .list, DAT??????.long and
+# SIM??????_coreas/raw_*.dat) or as hdf5 file written by coreas_to_hdf5_mods.py (SIM??????.hdf5 and/or
+# SIM??????_highlevel.hdf5).
+#
+# Nothing is read when a Shower is created. Every quantity is read on first access and then kept, traces
+# are only read for the requested antennas. Traces stored as uncompressed hdf5 datasets (one per antenna) are memory-mapped.
+
+import glob
+import os
+import sys
+from functools import cached_property
+
+import h5py
+import numpy as np
+
+from coreas_to_hdf5_mods import parse_reas_file, parse_input_file, parse_longitudinal_profile, parse_antenna_list, \
+    get_simulation_filenames, get_observer_planes, read_observers, read_antenna_traces, stack_traces
+
+
+class Shower:
+    """
+    A CoREAS simulation.
+
+    Parameters
+    ----------
+    path : a SIM??????.reas file, a directory containing one, or an hdf5 file of coreas_to_hdf5_mods.py.
+           For SIM??????.hdf5 the highlevel quantities are taken from SIM??????_highlevel.hdf5 next to it (if it exists).
+
+    Example
+    -------
+    shower = Shower("SIM000001.hdf5")
+    zenith = shower.inputs["THETAP"][0]
+    trace = shower.get_trace("pos_12000_0_156400_sp")  # reads only this antenna
+    fluence = shower.get_highlevel("energy_fluence")   # reads only this dataset
+    """
+
+    def __init__(self, path):
+        self.reas_filename = None
+        self.hdf5_filename = None
+        self.highlevel_filename = None
+
+        if os.path.isdir(path):
+            reas_filenames = sorted(glob.glob(os.path.join(path, "SIM??????.reas")))
+            if len(reas_filenames) != 1:
+                sys.exit("Found %i .reas files in %s, expected one" % (len(reas_filenames), path))
+            path = reas_filenames[0]
+
+        if os.path.splitext(path)[1] in [".hdf5", ".h5"]:
+            if path.endswith("_highlevel" + os.path.splitext(path)[1]):
+                self.highlevel_filename = path
+            else:
+                self.hdf5_filename = path
+                highlevel_filename = os.path.splitext(path)[0] + "_highlevel" + os.path.splitext(path)[1]
+                if os.path.exists(highlevel_filename):
+                    self.highlevel_filename = highlevel_filename
+        elif os.path.exists(path):
+            self.reas_filename = path
+        else:
+            sys.exit("Could not find the simulation %s" % path)
+
+    def __repr__(self):
+        return "Shower(%s)" % (self.reas_filename or self.hdf5_filename or self.highlevel_filename)
+
+    def close(self):
+        """ Closes the hdf5 files (if opened) """
+        for key in ["_hdf5_file", "_highlevel_file"]:
+            if key in self.__dict__ and self.__dict__[key] is not None:
+                self.__dict__.pop(key).close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @cached_property
+    def _hdf5_file(self):
+        return h5py.File(self.hdf5_filename, "r") if self.hdf5_filename is not None else None
+
+    @cached_property
+    def _highlevel_file(self):
+        if self.highlevel_filename is None:
+            return None
+        return h5py.File(self.highlevel_filename, "r")
+
+    def _get_group(self, key):
+        """ returns the group from the full hdf5 file or (for 'CoREAS' and 'inputs') from the highlevel file """
+        for f_h5 in [self._hdf5_file, self._highlevel_file]:
+            if f_h5 is not None and key in f_h5:
+                return f_h5[key]
+        return None
+
+    @cached_property
+    def _filenames(self):
+        return get_simulation_filenames(self.reas_filename, self.reas)
+
+    @cached_property
+    def reas(self):
+        """ parameters of the .reas file (dict) """
+        if self.reas_filename is not None:
+            return parse_reas_file(self.reas_filename)
+        return dict(self._get_group("CoREAS").attrs)
+
+    @cached_property
+    def inputs(self):
+        """ cards of the CORSIKA input file (dict) """
+        if self.reas_filename is not None:
+            return parse_input_file(self._filenames[0])
+        return dict(self._get_group("inputs").attrs)
+
+    @cached_property
+    def long_profile(self):
+        """ longitudinal profile: dict with 'NumberOfParticles', 'EnergyDeposit' and 'Gaisser-Hillas-Fit' """
+        if self.reas_filename is not None:
+            return parse_longitudinal_profile(self._filenames[1])
+
+        f_h5_long = self._get_group("atmosphere")
+        if f_h5_long is None:
+            sys.exit("%s does not contain the longitudinal profile" % self)
+        return {"NumberOfParticles": f_h5_long["NumberOfParticles"][:], "EnergyDeposit": f_h5_long["EnergyDeposit"][:],
+                "Gaisser-Hillas-Fit": f_h5_long.attrs["Gaisser-Hillas-Fit"]}
+
+    @cached_property
+    def _observers(self):
+        """ names, positions, additional arguments and planes of all antennas """
+        if self.reas_filename is not None:
+            splits = [line.strip().split() for line in parse_antenna_list(self._filenames[2])]
+            names = [ll[5] for ll in splits]
+            additional_arguments = [ll[6:] for ll in splits] if len(splits) and len(splits[0]) > 6 else None
+            positions = np.array([ll[2:5] for ll in splits], dtype=float)
+            return names, positions, additional_arguments, get_observer_planes(names, additional_arguments)
+
+        f_h5_reas = self._get_group("CoREAS")
+        if f_h5_reas is None or ("observers" not in f_h5_reas and "observer_traces" not in f_h5_reas):
+            sys.exit("%s does not contain the antenna traces" % self)
+        return read_observers(f_h5_reas)
+
+    @cached_property
+    def antenna_names(self):
+        """ names of all antennas """
+        return list(self._observers[0])
+
+    @cached_property
+    def antenna_positions(self):
+        """ antenna positions (N_antennas, 3) in CORSIKA coordinates, in cm """
+        return self._observers[1]
+
+    @cached_property
+    def antenna_planes(self):
+        """ observation plane of each antenna (as determined by coreas_to_hdf5_mods.py) """
+        return self._observers[3]
+
+    @cached_property
+    def _antenna_index(self):
+        return {name: i for i, name in enumerate(self.antenna_names)}
+
+    def _get_index(self, name):
+        if name not in self._antenna_index:
+            sys.exit("Antenna %s not found in %s" % (name, self))
+        return self._antenna_index[name]
+
+    def get_trace(self, name):
+        """ Returns the trace (N_samples, 4: time, Ex, Ey, Ez in CORSIKA coordinates and cgs units) of one antenna.
+        Only the bytes of this antenna are read, for hdf5 files with one dataset per antenna they are memory-mapped. """
+        index = self._get_index(name)
+
+        if self.reas_filename is not None:
+            return np.loadtxt(os.path.join(self._filenames[3], "raw_%s.dat" % name), dtype=float, ndmin=2)
+
+        f_h5_reas = self._get_group("CoREAS")
+        if "observer_traces" in f_h5_reas:
+            return f_h5_reas["observer_traces"][index]
+        return _memmap_dataset(self.hdf5_filename, f_h5_reas["observers"][name])
+
+    def get_traces(self, names=None, n_threads=None):
+        """ Returns the traces of the given antennas (default: all) as array with the shape (N_antennas, N_samples, 4),
+        or as list of (N_samples, 4) arrays if the traces have different lengths """
+        if names is None:
+            names = self.antenna_names
+        indices = np.array([self._get_index(name) for name in names], dtype=int)
+
+        if self.reas_filename is not None:
+            return read_antenna_traces([os.path.join(self._filenames[3], "raw_%s.dat" % name) for name in names],
+                                       n_threads=n_threads, equal_shapes=False)
+
+        f_h5_reas = self._get_group("CoREAS")
+        if "observer_traces" in f_h5_reas:
+            # h5py needs increasing indices, read each antenna only once
+            unique, inverse = np.unique(indices, return_inverse=True)
+            return f_h5_reas["observer_traces"][unique, ...][inverse]
+        return stack_traces([self.get_trace(name) for name in names])
+
+    @cached_property
+    def highlevel(self):
+        """ highlevel group of coreas_to_hdf5_mods.py (h5py group, datasets are read on access), None if not available """
+        return self._get_group("highlevel")
+
+    @cached_property
+    def obsplanes(self):
+        """ names of the observation planes in the highlevel group """
+        if self.highlevel is None:
+            return []
+        return [key for key in self.highlevel.keys() if isinstance(self.highlevel[key], h5py.Group)]
+
+    def get_highlevel(self, quantity, plane=None):
+        """ Returns a highlevel quantity (e.g. 'energy_fluence', 'antenna_position') of an observation plane
+        (default: the only one), only this dataset is read. Attributes of the highlevel group are returned as well. """
+        if self.highlevel is None:
+            sys.exit("%s has no highlevel quantities" % self)
+        if quantity in self.highlevel.attrs:
+            return self.highlevel.attrs[quantity]
+
+        if plane is None:
+            if len(self.obsplanes) != 1:
+                sys.exit("%s has %i observation planes, specify one of %s" % (self, len(self.obsplanes), self.obsplanes))
+            plane = self.obsplanes[0]
+
+        group = self.highlevel[plane]
+        if quantity in group.attrs:
+            return group.attrs[quantity]
+        return group[quantity][()]
+
+
+def _memmap_dataset(filename, data_set):
+    """ returns a read-only memory map of an uncompressed, unchunked hdf5 dataset, otherwise reads it """
+    offset = data_set.id.get_offset()
+    if offset is None or data_set.chunks is not None or data_set.compression is not None:
+        return data_set[()]
+    return np.memmap(filename, mode="r", dtype=data_set.dtype, shape=data_set.shape, offset=offset)
@@ -7,10 +7,13 @@ import configparser
 import sys
 import io
 import re
+import gzip
+import itertools
 import argparse
 import h5py
 import math
 from scipy import integrate
+from concurrent.futures import ThreadPoolExecutor
 
 conversion_factor_integrated_signal = 2.65441729e-3 * 6.24150934e18  # to convert V**2/m**2 * s -> J/m**2 -> eV/m**2
 conversion_fieldstrength_cgs_to_SI = 2.99792458e4
@@ -43,46 +46,72 @@ def gaisser_hillas(X, N, X0, Xmax, p0, p1=0, p2=0):
         return result
 
 
-def read_input_file(hdf5_file, inp_file):
+def read_input_cards(inp_file):
+    """ Returns all cards of the CORSIKA input file (SIM??????.inp) as dict of their (string) arguments, skips empty lines """
 
     if not isinstance(inp_file, io.IOBase):
         inp_file = open(inp_file, "r")
 
     inp_dict = {}
-    for i, line in enumerate(inp_file.readlines()):
+    for line in inp_file.readlines():
         elements = line.strip().split()
-        inp_dict[elements[0]] = elements[1:]
+        if len(elements):
+            inp_dict[elements[0]] = elements[1:]
     inp_file.close()
 
-    f_h5_inputs = hdf5_file.create_group("inputs")
+    return inp_dict
 
-    # fill general attributes from inp file
-    f_h5_inputs.attrs["RUNNR"] = int(inp_dict["RUNNR"][0])
-    f_h5_inputs.attrs["EVTNR"] = int(inp_dict["EVTNR"][0])
-    f_h5_inputs.attrs["PRMPAR"] = int(inp_dict["PRMPAR"][0])
-    f_h5_inputs.attrs["ERANGE"] = np.array([float(inp_dict["ERANGE"][0]), float(inp_dict["ERANGE"][1])])
-    f_h5_inputs.attrs["THETAP"] = np.array([float(inp_dict["THETAP"][0]), float(inp_dict["THETAP"][1])])
-    f_h5_inputs.attrs["PHIP"] = np.array([float(inp_dict["PHIP"][0]), float(inp_dict["PHIP"][0])])
-    f_h5_inputs.attrs["ECUTS"] = np.array([float(inp_dict["ECUTS"][0]), float(inp_dict["ECUTS"][1]), float(inp_dict["ECUTS"][2]), float(inp_dict["ECUTS"][3])])
-    try:
-        f_h5_inputs.attrs["THIN"] = np.array([float(inp_dict["THIN"][0]), float(inp_dict["THIN"][1]), float(inp_dict["THIN"][2])])
-        f_h5_inputs.attrs["THINH"] = np.array([float(inp_dict["THINH"][0]), float(inp_dict["THINH"][1])])
-    except KeyError:
-        pass
-    f_h5_inputs.attrs["OBSLEV"] = float(inp_dict["OBSLEV"][0])
-    f_h5_inputs.attrs["MAGNET"] = np.array([float(inp_dict["MAGNET"][0]), float(inp_dict["MAGNET"][1])])
 
+def get_atmosphere_model_number(inp_dict):
+    """ Returns the atmosphere model of the input cards: ATMOD, or for external atmospheres (ATMFILE)
+    41 for the GDAS file of Dunhuang and 1 (CORSIKA default, U.S standard by Linsley) for all others """
     try:
-        f_h5_inputs.attrs["ATMOD"] = int(inp_dict["ATMOD"][0])
+        return int(inp_dict["ATMOD"][0])
     except KeyError:
         if str(inp_dict["ATMFILE"][0]) == "/home/hk-project-radiohfi/bg5912/work/soft/corsika-77420/run//ATMOSPHERE_20170401120000_Dunhuang.DAT":
-            f_h5_inputs.attrs["ATMOD"] = 41
+            return 41
 
         else:
-            f_h5_inputs.attrs["ATMOD"] = 1  # CORSIKA default, U.S standard by Linsley
+            return 1  # CORSIKA default, U.S standard by Linsley
 
 
-def read_reas_file(hdf5_file, reas_file):
+def parse_input_file(inp_file):
+    """ Returns the cards of the CORSIKA input file (SIM??????.inp), as stored in the 'inputs' group of the hdf5 file """
+
+    inp_dict = read_input_cards(inp_file)
+
+    inputs = {}
+
+    # fill general attributes from inp file
+    inputs["RUNNR"] = int(inp_dict["RUNNR"][0])
+    inputs["EVTNR"] = int(inp_dict["EVTNR"][0])
+    inputs["PRMPAR"] = int(inp_dict["PRMPAR"][0])
+    inputs["ERANGE"] = np.array([float(inp_dict["ERANGE"][0]), float(inp_dict["ERANGE"][1])])
+    inputs["THETAP"] = np.array([float(inp_dict["THETAP"][0]), float(inp_dict["THETAP"][1])])
+    inputs["PHIP"] = np.array([float(inp_dict["PHIP"][0]), float(inp_dict["PHIP"][0])])
+    inputs["ECUTS"] = np.array([float(inp_dict["ECUTS"][0]), float(inp_dict["ECUTS"][1]), float(inp_dict["ECUTS"][2]), float(inp_dict["ECUTS"][3])])
+    try:
+        inputs["THIN"] = np.array([float(inp_dict["THIN"][0]), float(inp_dict["THIN"][1]), float(inp_dict["THIN"][2])])
+        inputs["THINH"] = np.array([float(inp_dict["THINH"][0]), float(inp_dict["THINH"][1])])
+    except KeyError:
+        pass
+    inputs["OBSLEV"] = float(inp_dict["OBSLEV"][0])
+    inputs["MAGNET"] = np.array([float(inp_dict["MAGNET"][0]), float(inp_dict["MAGNET"][1])])
+
+    inputs["ATMOD"] = get_atmosphere_model_number(inp_dict)
+
+    return inputs
+
+
+def read_input_file(hdf5_file, inp_file):
+
+    f_h5_inputs = hdf5_file.create_group("inputs")
+    for key, value in parse_input_file(inp_file).items():
+        f_h5_inputs.attrs[key] = value
+
+
+def parse_reas_file(reas_file):
+    """ Returns the parameters of the CoREAS steering file (SIM??????.reas), as stored in the 'CoREAS' group of the hdf5 file """
 
     if not isinstance(reas_file, io.IOBase):
         reas_file = open(reas_file, "r")
@@ -100,9 +129,7 @@ def read_reas_file(hdf5_file, reas_file):
     configParser.read_file(tmp2)
     items = configParser.items("CoREAS")
 
-    f_h5_reas = hdf5_file.create_group("CoREAS")
-
-    # store content of reas file as attributes
+    reas = {}
     for key, value in items:
         if key in ["CoreCoordinateNorth", "CoreCoordinateWest", "CoreCoordinateVertical",
                    "TimeResolution", "AutomaticTimeBoundaries", "TimeLowerBoundary",
@@ -113,57 +140,143 @@ def read_reas_file(hdf5_file, reas_file):
                    "PrimaryParticleEnergy", "PrimaryParticleType", "DepthOfShowerMaximum", "DistanceOfShowerMaximum",
                    "MagneticFieldStrength", "MagneticFieldInclinationAngle"]:
             if key not in ["EventNumber", "RunNumber", "GPSSecs", "GPSNanoSecs", "PrimaryParticleType"]:
-                f_h5_reas.attrs[key] = float(value)
+                reas[key] = float(value)
             else:
-                f_h5_reas.attrs[key] = int(value)
+                reas[key] = int(value)
         else:
-            f_h5_reas.attrs[key] = value
+            reas[key] = value
 
+    return reas
 
-def read_longitudinal_profile(hdf5_file, long_file):
+
+def read_reas_file(hdf5_file, reas_file):
+
+    f_h5_reas = hdf5_file.create_group("CoREAS")
+
+    # store content of reas file as attributes
+    for key, value in parse_reas_file(reas_file).items():
+        f_h5_reas.attrs[key] = value
+
+
+# CORSIKA writes negative numbers without separating blank when a column is full, e.g. "1.5E+03-2.0E+02"
+glued_negative_number = re.compile(r"([0-9])-")
+
+
+def open_longitudinal_profile(long_filename):
+    """ opens a CORSIKA .long file (or a compressed .long.gz file) as text """
+    if long_filename.endswith(".gz"):
+        return gzip.open(long_filename, "rt", encoding="UTF-8")
+    return io.open(long_filename, "r", encoding="UTF-8")
+
+
+def read_longitudinal_table(long_file, n_steps, glued_negatives=False):
+    """ reads a table of n_steps rows (after its column header) from the current position of the .long file """
+    next(long_file)  # column names
+    block = "".join(itertools.islice(long_file, n_steps))
+    if glued_negatives:
+        block = glued_negative_number.sub(r"\1 -", block)
+
+    data = np.array(block.split(), dtype=float)
+    if data.size % n_steps:
+        sys.exit("Table of the .long file %s is incomplete" % getattr(long_file, "name", ""))
+    return data.reshape(n_steps, -1)
+
+
+def parse_longitudinal_profile(long_file):
+    """ Returns the longitudinal profiles of the particle numbers ('NumberOfParticles') and the energy deposit
+    ('EnergyDeposit') and the Gaisser-Hillas fit ('Gaisser-Hillas-Fit') of the CORSIKA .long file (or .long.gz).
+    The file is read in a single pass, each table is converted at once. """
 
     if not isinstance(long_file, io.IOBase):
-        long_file = io.open(long_file, "r", encoding="UTF-8")
+        long_file = open_longitudinal_profile(long_file)
 
-    f_h5_long = hdf5_file.create_group("atmosphere")
+    n_data = None
+    dE_data = None
+    hillas_parameter = []
+    for line in long_file:
+        if n_data is None and "LONGITUDINAL DISTRIBUTION" in line:
+            # number of steps, e.g. "LONGITUDINAL DISTRIBUTION IN   50 VERTICAL STEPS OF ..." (no blank for >= 10^5 steps)
+            n_steps = int(re.search(r"IN\s*([0-9]+)", line).group(1))
+            n_data = read_longitudinal_table(long_file, n_steps)
+        elif dE_data is None and "LONGITUDINAL ENERGY DEPOSIT" in line:
+            n_steps = int(re.search(r"IN\s*([0-9]+)", line).group(1))
+            dE_data = read_longitudinal_table(long_file, n_steps, glued_negatives=True)
+        elif "PARAMETERS" in line:
+            # read out hillas fit
+            hillas_parameter = [float(x) for x in glued_negative_number.sub(r"\1 -", line).split()[2:]]  # strip aways 'PARAMETER', '='
 
-    lines = long_file.readlines()
-    n_steps = int(lines[0].rstrip().split()[3])
+    long_file.close()
 
-    def my_replace(m):
-        return str(m.group(0)[0]) + " -"
+    return {"NumberOfParticles": n_data, "EnergyDeposit": dE_data, "Gaisser-Hillas-Fit": hillas_parameter}
 
-    n_data_str = io.StringIO()
-    n_data_str.writelines(lines[2:(n_steps + 2)])
-    n_data_str.seek(0)
 
-    n_data = np.genfromtxt(n_data_str)
-    for i, line in enumerate(lines):
-        lines[i] = re.sub("[0-9]-", my_replace, line)
+def read_longitudinal_profile(hdf5_file, long_file):
 
-    dE_data_str = io.StringIO()
-    dE_data_str.writelines(lines[(n_steps + 4):(2 * n_steps + 4)])
-    dE_data_str.seek(0)
-    dE_data = np.genfromtxt(dE_data_str)
+    f_h5_long = hdf5_file.create_group("atmosphere")
+    long_profile = parse_longitudinal_profile(long_file)
+
+    n_data = long_profile["NumberOfParticles"]
     data_set = f_h5_long.create_dataset("NumberOfParticles", n_data.shape, dtype="f")
     data_set[...] = n_data
     data_set.attrs['comment'] = "The collumns of the data set are: DEPTH, GAMMAS, POSITRONS, ELECTRONS, MU+, MU-, HADRONS, CHARGED, NUCLEI, CHERENKOV"
 
+    dE_data = long_profile["EnergyDeposit"]
     data_set = f_h5_long.create_dataset("EnergyDeposit", dE_data.shape, dtype="f")
     data_set[...] = dE_data
     data_set.attrs['comment'] = "The collumns of the data set are: DEPTH, GAMMA, EM IONIZ, EM CUT, MU IONIZ, MU CUT, HADR IONIZ, HADR CUT, NEUTRINO, SUM"
 
-    # read out hillas fit
-    hillas_parameter = []
-    for line in lines:
-        if bool(re.search("PARAMETERS", line)):
-            hillas_parameter = [float(x) for x in line.split()[2:]]  # strip aways 'PARAMETER', '='
-    f_h5_long.attrs['Gaisser-Hillas-Fit'] = hillas_parameter
+    f_h5_long.attrs['Gaisser-Hillas-Fit'] = long_profile["Gaisser-Hillas-Fit"]
+
+
+def read_antenna_traces(antenna_files, n_threads=None, equal_shapes=True):
+    """
+    Reads the CoREAS traces of many antennas (raw_<name>.dat: time and the electric field in x, y, z
+    in 4 columns) into one contiguous array. The files are parsed with np.loadtxt (much faster than np.genfromtxt)
+    by a pool of threads, which hides the latency of (parallel) file systems.
+
+    Parameters
+    ----------
+    antenna_files : list of paths to the raw_*.dat files
+    n_threads : number of threads (default: ThreadPoolExecutor default)
+    equal_shapes : if True, all traces must have the same length as the first one (exits otherwise).
+                   If False, traces of different lengths are returned as a list with one array per antenna.
+
+    Returns
+    -------
+    traces : array with the shape (N_antennas, N_samples, 4), or a list of (N_samples, 4) arrays
+             if equal_shapes is False and the lengths differ
+    """
+    antenna_files = list(antenna_files)
+    if not len(antenna_files):
+        return np.zeros((0, 0, 4))
+
+    first = np.loadtxt(antenna_files[0], dtype=float, ndmin=2)
+    traces = np.empty((len(antenna_files),) + first.shape, dtype=float)
+    traces[0] = first
+    other_shapes = {}  # traces which do not fit into the array, by index
+
+    def read(index):
+        data = np.loadtxt(antenna_files[index], dtype=float, ndmin=2)
+        if data.shape != first.shape:
+            other_shapes[index] = data
+        else:
+            traces[index] = data
 
-    long_file.close()
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        list(executor.map(read, range(1, len(antenna_files))))
+
+    if len(other_shapes):
+        if equal_shapes:
+            index = min(other_shapes)
+            sys.exit("Trace in %s has the shape %s, expected %s (as in %s)" %
+                     (antenna_files[index], other_shapes[index].shape, first.shape, antenna_files[0]))
+        return [other_shapes[index] if index in other_shapes else traces[index] for index in range(len(antenna_files))]
+
+    return traces
 
 
-def read_antenna_data(hdf5_file, list_file, antenna_folder):
+def parse_antenna_list(list_file):
+    """ Returns the lines of the antenna list (SIM??????.list) without empty lines and comments """
 
     if not isinstance(list_file, io.IOBase):
         list_file = open(list_file, "r")
@@ -172,28 +285,176 @@ def read_antenna_data(hdf5_file, list_file, antenna_folder):
     lines = np.array([item for item in lines if not item.startswith("#")])  # skip comments
     list_file.close()
 
+    return lines
+
+
+def read_antenna_data(hdf5_file, list_file, antenna_folder, n_threads=None, batch_size=1000, contiguous=False):
+
+    lines = parse_antenna_list(list_file)
+
+    if contiguous:
+        write_contiguous_antenna_data(hdf5_file, lines, antenna_folder, n_threads=n_threads, batch_size=batch_size)
+        return
+
     observers = hdf5_file.create_group('observers')
 
-    for line in lines:
-        ll = line.strip().split()
-        antenna_position = ll[2:5]
-        antenna_label = ll[5]
-        antenna_file = os.path.join(antenna_folder, "raw_%s.dat" % antenna_label)
+    # read the traces in batches, to limit the memory for very large antenna arrays
+    for start in range(0, len(lines), batch_size):
+        batch = [line.strip().split() for line in lines[start:start + batch_size]]
+        antenna_files = [os.path.join(antenna_folder, "raw_%s.dat" % ll[5]) for ll in batch]
+        # the traces of the antennas can have different lengths in this layout
+        traces = read_antenna_traces(antenna_files, n_threads=n_threads, equal_shapes=False)
+
+        for ll, data in zip(batch, traces):
+            antenna_position = ll[2:5]
+            antenna_label = ll[5]
+
+            data_set = observers.create_dataset(antenna_label, data.shape, dtype=float)
+            data_set[...] = data
+
+            data_set.attrs['position'] = np.array(antenna_position, dtype=float)
+            data_set.attrs['name'] = antenna_label
+
+            # there seems to be a problem when storing a list of unicodes in an attribute (is the case for python3). followed the fix from:
+            # https://github.com/h5py/h5py/issues/289
+            if (len(ll) > 6):
+                data_set.attrs['additional_arguments'] =  [a.encode('utf8') for a in ll[6:]]
+
+
+def get_observer_planes(names, additional_arguments=None):
+    """ Returns the observation plane of each antenna, from its additional arguments
+    (slicing of the antenna, if given in the .list file) or from its name (e.g. pos_<ring>_<arm>_<obslevel>_<plane>) """
+    if additional_arguments is not None:
+        return np.array(["_".join([str(xx).strip("b'").strip("'") for xx in x]) for x in additional_arguments])
+
+    if len(names[0].split("_")) < 4:
+        return np.array(["na_na"] * len(names))
+    elif len(names[0].split("_")) == 4:
+        return np.array([x.rstrip().split("_")[3] + "_na" for x in names])
+    else:
+        return np.array([x.rstrip().split("_")[3] + "_" + x.rstrip().split("_")[4] for x in names])
+
+
+def write_contiguous_antenna_data(hdf5_file, lines, antenna_folder, n_threads=None, batch_size=1000):
+    """
+    Stores the traces of all antennas of the .list file (lines) in one chunked, compressed dataset
+    'observer_traces' with the shape (N_antennas, N_samples, 4) in the order of the .list file, together with
+    the arrays 'observer_positions' (N_antennas, 3), 'observer_names', 'observer_planes' (the observation planes)
+    and 'observer_plane_index' (the plane of each antenna), and 'observer_additional_arguments' if the .list file has them.
+    Use read_observers / read_observer_traces to read either layout.
+    """
+    splits = [line.strip().split() for line in lines]
+    names = [ll[5] for ll in splits]
+    additional_arguments = None
+    if len(splits) and len(splits[0]) > 6:
+        additional_arguments = [ll[6:] for ll in splits]
+
+    planes = get_observer_planes(names, additional_arguments)
+    planes_unique, plane_index = np.unique(planes, return_inverse=True)
+
+    string_dtype = h5py.special_dtype(vlen=str)
+    hdf5_file.create_dataset("observer_names", data=np.array(names, dtype=object), dtype=string_dtype)
+    hdf5_file.create_dataset("observer_positions", data=np.array([ll[2:5] for ll in splits], dtype=float))
+    hdf5_file.create_dataset("observer_planes", data=np.array(planes_unique, dtype=object), dtype=string_dtype)
+    hdf5_file.create_dataset("observer_plane_index", data=plane_index)
+    if additional_arguments is not None:
+        hdf5_file.create_dataset("observer_additional_arguments", dtype=string_dtype,
+                                 data=np.array([" ".join(ll[6:]) for ll in splits], dtype=object))
+
+    data_set = None
+    for start in range(0, len(splits), batch_size):
+        antenna_files = [os.path.join(antenna_folder, "raw_%s.dat" % name) for name in names[start:start + batch_size]]
+        traces = read_antenna_traces(antenna_files, n_threads=n_threads)
+
+        if data_set is None:
+            # chunks of several whole traces, a plane is read with few calls
+            shape = (len(names),) + traces.shape[1:]
+            data_set = hdf5_file.create_dataset("observer_traces", shape, dtype=float, compression="gzip",
+                                                compression_opts=4, shuffle=True,
+                                                chunks=(min(len(names), 64),) + traces.shape[1:])
+        elif traces.shape[1:] != data_set.shape[1:]:
+            sys.exit("All traces must have the same length for the contiguous layout, %s has %i samples instead of %i" %
+                     (antenna_files[0], traces.shape[1], data_set.shape[1]))
+
+        data_set[start:start + len(traces)] = traces
+
+
+def read_observers(f_h5_reas):
+    """
+    Returns names, positions (CORSIKA coordinates, in cm), additional arguments (None if not given) and the
+    observation planes of all antennas in the CoREAS group of a converted simulation, with one dataset per antenna
+    ('observers') or with the contiguous layout (see write_contiguous_antenna_data).
+    """
+    if "observer_traces" in f_h5_reas:
+        names = [x.decode("utf8") if isinstance(x, bytes) else x for x in f_h5_reas["observer_names"][:]]
+        positions = f_h5_reas["observer_positions"][:]
+        additional_arguments = None
+        if "observer_additional_arguments" in f_h5_reas:
+            additional_arguments = [(x.decode("utf8") if isinstance(x, bytes) else x).split()
+                                    for x in f_h5_reas["observer_additional_arguments"][:]]
+        planes_unique = np.array([x.decode("utf8") if isinstance(x, bytes) else x for x in f_h5_reas["observer_planes"][:]])
+        planes = planes_unique[f_h5_reas["observer_plane_index"][:]]
+        return names, positions, additional_arguments, planes
+
+    obs_values = list(f_h5_reas["observers"].values())
+    names = [x.attrs["name"] for x in obs_values]
+    positions = np.array([x.attrs["position"] for x in obs_values])
+    additional_arguments = None
+    if "additional_arguments" in obs_values[0].attrs.keys():
+        additional_arguments = [x.attrs["additional_arguments"] for x in obs_values]
 
-        data = np.genfromtxt(antenna_file)
-        data_set = observers.create_dataset(antenna_label, data.shape, dtype=float)
-        data_set[...] = data
+    # the names of the datasets (alphabetical order) are used to determine the planes as before
+    planes = get_observer_planes(list(f_h5_reas["observers"].keys()), additional_arguments)
+    return names, positions, additional_arguments, planes
 
-        data_set.attrs['position'] = np.array(antenna_position, dtype=float)
-        data_set.attrs['name'] = antenna_label
 
-        # there seems to be a problem when storing a list of unicodes in an attribute (is the case for python3). followed the fix from:
-        # https://github.com/h5py/h5py/issues/289
-        if (len(ll) > 6):
-            data_set.attrs['additional_arguments'] =  [a.encode('utf8') for a in ll[6:]]
+def stack_traces(traces):
+    """ Returns the traces as one array (N_antennas, N_samples, 4) if they have the same length,
+    otherwise as list of arrays """
+    if len(set(trace.shape for trace in traces)) > 1:
+        return list(traces)
+    return np.array(traces)
+
+
+def read_observer_traces(f_h5_reas, indices):
+    """ Returns the traces (time, x, y, z) of the antennas with the (ascending) indices of read_observers
+    as array with the shape (len(indices), N_samples, 4). For the contiguous layout this is a single read.
+    In the layout with one dataset per antenna the traces can have different lengths, they are then
+    returned as list of (N_samples, 4) arrays.
+
+    The antennas of the contiguous layout (--contiguous) are in the order of the antenna list (.list file),
+    those of the layout with one dataset per antenna in the alphabetical order of their names. """
+    indices = np.asarray(indices)
+    if "observer_traces" in f_h5_reas:
+        return f_h5_reas["observer_traces"][indices, ...]
+
+    obs_values = list(f_h5_reas["observers"].values())
+    return stack_traces([obs_values[j][:] for j in indices])
+
+
+def get_simulation_filenames(reas_filename, reas=None):
+    """ Returns the CORSIKA input file, the .long file, the antenna list and the directory of the antenna traces
+    of the simulation of the given .reas file (reas: its parameters, if already parsed) """
+    if reas is None:
+        reas = parse_reas_file(reas_filename)
+
+    # print error message in case CorsikaParameterFile was not specified in the .reas file
+    inp_filename = reas['CorsikaParameterFile']
+    if len(inp_filename) == 0:
+        sys.exit("CorsikaParameterFile was not specified in the .reas file, aborting!")
+
+    directory = os.path.dirname(reas_filename)
+    long_filename = "DAT" + os.path.splitext(os.path.basename(reas_filename))[0][-6:] + ".long"
+    if not os.path.exists(os.path.join(directory, long_filename)) and \
+            os.path.exists(os.path.join(directory, long_filename + ".gz")):
+        long_filename += ".gz"
+    number = os.path.splitext(os.path.basename(reas_filename))[0][3:]
 
+    return os.path.join(directory, inp_filename), os.path.join(directory, long_filename), \
+        os.path.splitext(reas_filename)[0] + ".list", os.path.join(directory, "SIM%s_coreas" % number)
 
-def write_coreas_hdf5_file(reas_filename, output_filename, f_h5=None):
+
+def write_coreas_hdf5_file(reas_filename, output_filename, f_h5=None, contiguous=False):
 
     # create hdf5 file
     if f_h5 is None:
@@ -204,25 +465,17 @@ def write_coreas_hdf5_file(reas_filename, output_filename, f_h5=None):
     # read all parameter from the SIM??????.reas file
     read_reas_file(f_h5, reas_filename)
 
-    # print error message in case CorsikaParameterFile was not specified in the .reas file
-    inp_filename = f_h5['CoREAS'].attrs['CorsikaParameterFile']
-    if len(inp_filename) == 0:
-        sys.exit("CorsikaParameterFile was not specified in the .reas file, aborting!")
-    finp = open(os.path.join(os.path.dirname(reas_filename), inp_filename), "r")
+    inp_filename, long_filename, list_filename, antenna_folder = \
+        get_simulation_filenames(reas_filename, dict(f_h5['CoREAS'].attrs))
 
     # read cards from .inp file and stores them into "inputs" group in f_h5 file
-    read_input_file(f_h5, finp)
+    read_input_file(f_h5, inp_filename)
 
     # read in long file
-    long_filename = "DAT" + os.path.splitext(os.path.basename(reas_filename))[0][-6:] + ".long"
-    longinp = io.open(os.path.join(os.path.dirname(reas_filename), long_filename), "r", encoding="UTF-8")
-    read_longitudinal_profile(f_h5, longinp)
+    read_longitudinal_profile(f_h5, long_filename)
 
     # read in antenna data
-    listfile = open(os.path.splitext(reas_filename)[0] + ".list", "r")
-    number = os.path.splitext(os.path.basename(reas_filename))[0][3:]
-    antenna_folder = os.path.join(os.path.dirname(reas_filename), "SIM%s_coreas" % number)
-    read_antenna_data(f_h5['CoREAS'], listfile, antenna_folder)
+    read_antenna_data(f_h5['CoREAS'], list_filename, antenna_folder, contiguous=contiguous)
 
     return f_h5
 
@@ -272,6 +525,30 @@ def write_highlevel_attributes(f_h5_hl, f_h5):
     f_h5_hl.attrs["gaisser_hillas_dEdX"] = popt
 
 
+def convert_plane_traces(traces, ctrans, trace_dtype=np.float64, use_vB_vvB_polarization=True):
+    """
+    Converts the CoREAS traces (N_antennas, N_samples, 4) of an observation plane: the electric field from CORSIKA
+    to AUGER coordinates (AUGER y = CORSIKA x, AUGER x = - CORSIKA y) and to SI units, and rotated into the
+    vxB, vxvxB, v polarisations with a single matrix product (if use_vB_vvB_polarization).
+    The times are always kept in double precision, the electric field in the precision trace_dtype.
+
+    Returns
+    -------
+    times : array (N_antennas, N_samples)
+    efield : array (N_antennas, N_samples, 3)
+    """
+    times = traces[..., 0]
+    efield = np.array(traces[..., 1:4], dtype=trace_dtype)
+
+    efield[..., 0], efield[..., 1] = -efield[..., 1], efield[..., 0].copy()
+    efield *= conversion_fieldstrength_cgs_to_SI
+
+    if use_vB_vvB_polarization:
+        ctrans.transform_traces_to_vxB_vxvxB(efield, inplace=True)
+
+    return times, efield
+
+
 def write_coreas_highlevel_file(output_filename, f_h5, args, f_h5_sephl=None):
 
     # create file
@@ -301,7 +578,7 @@ def write_coreas_highlevel_file(output_filename, f_h5, args, f_h5_sephl=None):
     B_strength = (Bx ** 2 + Bz ** 2) ** 0.5
     magnetic_field_vector = rdhelp.spherical_to_cartesian(B_inclination + np.pi / 2, B_declination + np.pi * 0.5)  # in auger cooordinates north is + 90 deg
 
-    ctrans = coordinatesystems.cstrafo(zenith, azimuth, magnetic_field_vector=magnetic_field_vector)
+    ctrans = cstransform(zenith, azimuth, magnetic_field_vector=magnetic_field_vector)
 
     f_h5_hl.attrs['zenith'] = zenith
     f_h5_hl.attrs['azimuth'] = azimuth
@@ -313,32 +590,21 @@ def write_coreas_highlevel_file(output_filename, f_h5, args, f_h5_sephl=None):
 
 
     # check for simulation of different observation planes
-    f_h5_reas = f_h5["CoREAS"]
-    observers = f_h5_reas["observers"]
-    names = list(observers.keys())
-    obs_values = list(observers.values())
-
     # if additional arguments were set use then to determine observeration planes
     # otherwise use names
-    if "additional_arguments" in obs_values[0].attrs.keys():
-        # concetinate
-        planes = np.array(["_".join([str(xx).strip("b'").strip("'") for xx in x.attrs["additional_arguments"]]) for x in obs_values])
-        planes_unique = np.unique(planes, axis=0)
-    else:
-        if len(names[0].split("_")) < 4:
-            planes = np.array(["na_na"] * len(names))
-        elif len(names[0].split("_")) == 4:
-            planes = np.array([x.rstrip().split("_")[3] + "_na" for x in names])
-        elif len(names[0].split("_")) >= 4:
-            planes = np.array([x.rstrip().split("_")[3] + "_" + x.rstrip().split("_")[4] for x in names])
-        planes_unique = np.unique(planes)
+    f_h5_reas = f_h5["CoREAS"]
+    observer_names, observer_positions, additional_arguments, planes = read_observers(f_h5_reas)
+    planes_unique = np.unique(planes)
+
+    # precision of the trace processing (the time axis is always kept in double precision)
+    trace_dtype = np.float32 if args.use_float32 else np.float64
 
     if args.use_vB_vvB_polarization:
         print("Traces are stored and all relevant quantities are determined in vxB, vxvxB, and v polarization!")
     else:
         print("Traces are stored and all relevant quantities are determined in x, y, and z polarization!")
 
-    index = np.array(range(len(observers.keys())))
+    index = np.array(range(len(observer_names)))
 
     for plane in planes_unique:
         observation_height = f_h5_reas.attrs["CoreCoordinateVertical"] * 1e-2  # conversion to m
@@ -368,10 +634,29 @@ def write_coreas_highlevel_file(output_filename, f_h5, args, f_h5_sephl=None):
         slicing_boundaries = []
         slicing_method = ""
         names = []
+
+        # read the traces of all antennas in this plane at once
+        plane_traces = read_observer_traces(f_h5_reas, index[mask_plane])
+        if isinstance(plane_traces, list):
+            # traces of different lengths (e.g. with ResolutionReductionScale): convert the antennas of each length together
+            plane_times = [None] * nantennas
+            efield = [None] * nantennas
+            lengths = np.array([len(trace) for trace in plane_traces])
+            for length in np.unique(lengths):
+                group = np.where(lengths == length)[0]
+                group_times, group_efield = convert_plane_traces(np.array([plane_traces[i] for i in group]), ctrans,
+                                                                 trace_dtype, args.use_vB_vvB_polarization)
+                for k, i in enumerate(group):
+                    plane_times[i] = group_times[k]
+                    efield[i] = group_efield[k]
+        else:
+            plane_times, efield = convert_plane_traces(plane_traces, ctrans, trace_dtype, args.use_vB_vvB_polarization)
+        del plane_traces
+
         for i, j in enumerate(index[mask_plane]):
             # antenna_position[j] = (observers.values()[mask_plane][j].split(" ")[2:5])
-            position = obs_values[j].attrs["position"]
-            name = obs_values[j].attrs["name"]
+            position = observer_positions[j]
+            name = observer_names[j]
             names.append(name)
             # name = lines[mask_plane][j].split(" ")[5]
             try:
@@ -380,8 +665,8 @@ def write_coreas_highlevel_file(output_filename, f_h5, args, f_h5_sephl=None):
                 pass
 
             # read slice
-            if("additional_arguments" in obs_values[j].attrs.keys()):
-                line_split = obs_values[j].attrs["additional_arguments"]
+            if(additional_arguments is not None):
+                line_split = additional_arguments[j]
                 if len(line_split) == 3:
                     slicing_method = line_split[0]
                     slicing_boundaries.append([float(line_split[1]), float(line_split[2])])
@@ -392,34 +677,25 @@ def write_coreas_highlevel_file(output_filename, f_h5, args, f_h5_sephl=None):
                 else:
                     sys.exit("Length of additional arguments is wrong")
 
-            # convert CORSIKA to AUGER coordinates (AUGER y = CORSIKA x, AUGER x = - CORSIKA y
+            # converted (and rotated) traces, see above
             # TODO: add roation to correct north
-            data = np.copy(obs_values[j])
-            data[:, 1], data[:, 2] = -obs_values[j][:, 2], obs_values[j][:, 1]
-
-            # convert to SI units
-            data[:, 1] *= conversion_fieldstrength_cgs_to_SI
-            data[:, 2] *= conversion_fieldstrength_cgs_to_SI
-            data[:, 3] *= conversion_fieldstrength_cgs_to_SI
+            times = plane_times[i]
+            trace = efield[i]
 
             # convert CORSIKA to AUGER coordinates (AUGER y = CORSIKA x, AUGER x = - CORSIKA y; cm to m
             antenna_position[i, 0], antenna_position[i, 1], antenna_position[i, 2] = -position[1] / 100., position[0] / 100., position[2] / 100.
 
-            if np.sum(np.isnan(data[:, 1:4])):
+            if np.sum(np.isnan(trace)):
                 print("ERROR in antenna %j, time trace contains NaN" % j)
                 import sys
                 sys.exit(-1)
 
-            if args.use_vB_vvB_polarization:
-                # transform time traces into vxB-vxvxB frame
-                data[:, 1:4] = ctrans.transform_to_vxB_vxvxB(data[:, 1:4])
-
             # needs to be done because it is more precise for stepsizes of the order of 1e-10
-            dlength = data.shape[0]
-            tstep = data[1, 0] - data[0, 0]
+            dlength = trace.shape[0]
+            tstep = times[1] - times[0]
             if (f_h5_reas.attrs['ResolutionReductionScale'] == 0):
                 tstep = f_h5_reas.attrs['TimeResolution']
-                data[:, 0] = tstep * np.arange(dlength) + data[0, 0]
+                times[:] = tstep * np.arange(dlength) + times[0]
 
             # add zeros to beginning and end of the trace to increase the frequency resolution (this is not a resampling)
             #n_samples = int(np.round(2048e-9 * 5 / tstep))
@@ -427,16 +703,16 @@ def write_coreas_highlevel_file(output_filename, f_h5, args, f_h5_sephl=None):
             #increase number of samples to a power of two for FFT performance reasons
             n_samples = int(2**math.ceil(math.log(n_samples,2)))
 
-            n_start = (n_samples - len(data[:, 0])) // 2
-            padded_trace = np.zeros((n_samples, 3))
-            padded_trace[n_start:(n_start + len(data[:, 0]))] = data[:, 1:4]
+            n_start = (n_samples - dlength) // 2
+            padded_trace = np.zeros((n_samples, 3), dtype=trace_dtype)
+            padded_trace[n_start:(n_start + dlength)] = trace
 
             # get frequency spectrum
             spec = np.fft.rfft(padded_trace, axis=-2)
 
             # get new time and frequency binning
             ff = np.fft.rfftfreq(n_samples, tstep)  # frequencies in Hz
-            tt = tstep * np.arange(n_samples) + data[0, 0]
+            tt = tstep * np.arange(n_samples) + times[0]
             tt *= 1e9  #  time in ns
 
             # determine actual frequency resolution
@@ -451,13 +727,13 @@ def write_coreas_highlevel_file(output_filename, f_h5, args, f_h5_sephl=None):
                                       spec[..., 2] * window])
 
             # get filtered time series
-            filt = np.fft.irfft(filtered_spec, n_samples, axis=-1)
+            filt = np.fft.irfft(filtered_spec, n_samples, axis=-1).astype(trace_dtype, copy=False)
 
             if args.store_traces:
                 # assume that simulated time resolution is higher than a time resolution of tstep_resampled -> resampling traces
                 tstep_resampled = 1. / (args.sampling_frequency * 1e9)
                 n_resampled = int(np.floor(tstep / tstep_resampled * n_samples))
-                filt_short = np.fft.irfft(filtered_spec, n_resampled, axis=-1)
+                filt_short = np.fft.irfft(filtered_spec, n_resampled, axis=-1).astype(trace_dtype, copy=False)
 
                 # renormalizing amplitude
                 filt_short *= float(n_resampled / n_samples)
@@ -531,7 +807,7 @@ def write_coreas_highlevel_file(output_filename, f_h5, args, f_h5_sephl=None):
             polarization_vector[i] = rdhelp.get_polarization_vector_FWHM(filt)
 
             if args.store_traces:
-                times_filtered.append(tstep_resampled * np.arange(ishift, ishift + len(filt_short[0])) + data[0, 0])
+                times_filtered.append(tstep_resampled * np.arange(ishift, ishift + len(filt_short[0])) + times[0])
                 traces_filtered.append(filt_short.T)
 
         # shift antenna positions to core position of observation level
@@ -643,6 +919,10 @@ if __name__ == '__main__':
                         dest="store_full_simulation_in_hdf5", help="If set, the full, converter simulation will not be"
                              " stored in a hdf5 file and only the highlevel file is written to disk.")
 
+    parser.add_argument("--contiguous", action="store_true", dest="contiguous_layout",
+                        help="Store the traces of all antennas in one chunked, compressed dataset (CoREAS/observer_traces) "
+                             "with position, name and plane arrays instead of one dataset per antenna (CoREAS/observers)")
+
     parser.add_argument("--flow", type=float, default=30., help="low frequency cut in MHz")
     parser.add_argument("--fhigh", type=float, default=80., help="high frequency cut in MHz")
 
@@ -662,6 +942,11 @@ if __name__ == '__main__':
     parser.add_argument("--novB_vvB", action="store_false", dest="use_vB_vvB_polarization",
                         help="Return trace-related quantities in N, W, vertical instead of vxB, vxvxB and v polarizations")
 
+    parser.add_argument("--float32", action="store_true", dest="use_float32",
+                        help="Process (rotate, filter, resample and store) the electric-field traces in single instead of "
+                             "double precision. Halves the memory of the electric-field buffers (the spectra of np.fft.rfft "
+                             "are still complex128). The energy fluence deviates from the double precision result by ~7e-7 (relative)")
+
     parser.add_argument("--stokes", action="store_true", dest="calculate_stokes_parameter",
                         help="Calculates Stokes' parameter, in eV/m2")
     parser.add_argument("--stokes_window", type=float, default=25.,
@@ -680,13 +965,21 @@ if __name__ == '__main__':
             output_filename = os.path.join(args.output_directory, output_filename)
 
         if os.path.splitext(args.input_file)[1] != ".hdf5":
-            f_h5 = write_coreas_hdf5_file(reas_filename, output_filename)
+            f_h5 = write_coreas_hdf5_file(reas_filename, output_filename, contiguous=args.contiguous_layout)
 
         else:
             f_h5 = h5py.File(args.input_file, "r")
         
         from radiotools import helper as rdhelp
-        from radiotools import coordinatesystems
+
+        # coordinate transformations of this package (same matrices as radiotools.coordinatesystems.cstrafo),
+        # imported by file path so that no other "utils" package on sys.path is used
+        import importlib.util
+        coordtransform_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils", "coordtransform.py")
+        coordtransform_spec = importlib.util.spec_from_file_location("miniradiotools_coordtransform", coordtransform_filename)
+        coordtransform = importlib.util.module_from_spec(coordtransform_spec)
+        coordtransform_spec.loader.exec_module(coordtransform)
+        cstransform = coordtransform.cstransform
         # try:
         #     from radiotools import helper as rdhelp
         #     from radiotools import coordinatesystems
@@ -724,5 +1017,5 @@ if __name__ == '__main__':
         if(args.output_directory is not None):
             output_filename = os.path.join(args.output_directory, output_filename)
 
-        f_h5 = write_coreas_hdf5_file(reas_filename, output_filename)
+        f_h5 = write_coreas_hdf5_file(reas_filename, output_filename, contiguous=args.contiguous_layout)
         f_h5.close()
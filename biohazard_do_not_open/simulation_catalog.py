@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Catalog of the showers of a simulation library in an SQLite file.
+#
+# Every SIM??????.reas file (and the CORSIKA input file it refers to) in a directory tree is parsed once with the
+# parsers of coreas_to_hdf5_mods.py. Updating the catalog only parses files which are new or changed (by mtime)
+# since the last update and removes showers whose files were deleted.
+#
+# python simulation_catalog.py --dir <library> [--zenith 60 80] [--primary 14]
+
+import glob
+import os
+import sqlite3
+import sys
+from optparse import OptionParser
+
+from coreas_to_hdf5_mods import parse_reas_file, read_input_cards, get_atmosphere_model_number
+
+
+catalog_columns = [
+    # only zenith and obslevel are required, the other parameters are NULL if their cards are missing
+    ("reas_path", "TEXT PRIMARY KEY"),  # absolute path of the .reas file
+    ("inp_path", "TEXT"),  # absolute path of the CORSIKA input file
+    ("directory", "TEXT"),
+    ("run_number", "INTEGER"),
+    ("zenith", "REAL"),  # THETAP, in degrees
+    ("azimuth", "REAL"),  # PHIP (CORSIKA convention), in degrees
+    ("energy", "REAL"),  # lower limit of ERANGE, in GeV
+    ("primary", "INTEGER"),  # PRMPAR (CORSIKA particle code)
+    ("obslevel", "REAL"),  # CoreCoordinateVertical of the .reas file (radio observation level), in cm
+    ("obslevel_particles", "REAL"),  # OBSLEV of the input file, in cm
+    ("atmosphere", "INTEGER"),  # ATMOD
+    ("reas_mtime", "REAL"),
+    ("inp_mtime", "REAL"),
+]
+
+
+def get_catalog_filename(directory):
+    """ default file of the catalog of a simulation library """
+    return os.path.join(directory, "simulation_catalog.sqlite")
+
+
+def open_catalog(filename):
+    """ opens (and creates if needed) the catalog, returns an sqlite3 connection """
+    connection = sqlite3.connect(filename)
+    connection.row_factory = sqlite3.Row
+    connection.execute("CREATE TABLE IF NOT EXISTS simulations (%s)" %
+                       ", ".join('"%s" %s' % column for column in catalog_columns))
+    return connection
+
+
+def get_card(cards, name, dtype=float):
+    """ first argument of a card of the CORSIKA input file, None if the card is missing or invalid """
+    try:
+        return dtype(cards[name][0])
+    except (KeyError, IndexError, ValueError):
+        return None
+
+
+def parse_simulation(reas_filename):
+    """
+    Returns the catalog entry (dict) of a shower, from its .reas and CORSIKA input file (the CorsikaParameterFile
+    of the .reas file, or SIM??????.inp next to it). Only the zenith angle (THETAP) and the observation level
+    (CoreCoordinateVertical) are required, missing optional cards are stored as None (NULL).
+    """
+    reas = parse_reas_file(reas_filename)
+    if "CoreCoordinateVertical" not in reas:
+        sys.exit("CoreCoordinateVertical is not specified in %s" % reas_filename)
+
+    directory = os.path.dirname(reas_filename)
+    inp_filename = os.path.join(directory, reas["CorsikaParameterFile"]) if reas.get("CorsikaParameterFile") \
+        else os.path.splitext(reas_filename)[0] + ".inp"
+    cards = read_input_cards(inp_filename)
+
+    zenith = get_card(cards, "THETAP")
+    if zenith is None:
+        sys.exit("THETAP is not specified in %s" % inp_filename)
+
+    return {"reas_path": os.path.abspath(reas_filename),
+            "inp_path": os.path.abspath(inp_filename),
+            "directory": os.path.dirname(os.path.abspath(reas_filename)),
+            "run_number": get_card(cards, "RUNNR", int),
+            "zenith": zenith,
+            "azimuth": get_card(cards, "PHIP"),
+            "energy": get_card(cards, "ERANGE"),
+            "primary": get_card(cards, "PRMPAR", int),
+            "obslevel": float(reas["CoreCoordinateVertical"]),
+            "obslevel_particles": get_card(cards, "OBSLEV"),
+            "atmosphere": get_atmosphere_model_number(cards) if "ATMOD" in cards or "ATMFILE" in cards else None,
+            "reas_mtime": os.path.getmtime(reas_filename),
+            "inp_mtime": os.path.getmtime(inp_filename)}
+
+
+def update_catalog(directory, filename=None, pattern="**/SIM??????.reas", verbose=True):
+    """
+    Adds all showers in the directory tree (.reas files matching pattern) to the catalog, parses only new
+    or modified files and removes showers which no longer exist. Showers which cannot be parsed
+    (e.g. incomplete simulations) are skipped with a message and removed from the catalog if they were in it.
+
+    Parameters
+    ----------
+    directory : top directory of the simulation library
+    filename : file of the catalog (default: simulation_catalog.sqlite in directory)
+    pattern : glob pattern of the .reas files relative to directory, ** matches any number of subdirectories
+
+    Returns
+    -------
+    number of added or updated showers, number of removed showers
+    """
+    if filename is None:
+        filename = get_catalog_filename(directory)
+
+    reas_filenames = sorted(os.path.abspath(x) for x in glob.glob(os.path.join(directory, pattern), recursive=True))
+
+    connection = open_catalog(filename)
+    with connection:
+        known = {row["reas_path"]: row for row in
+                 connection.execute("SELECT reas_path, inp_path, reas_mtime, inp_mtime FROM simulations")}
+
+        n_updated = 0
+        removed = []
+        for reas_filename in reas_filenames:
+            row = known.get(reas_filename)
+            if row is not None and row["reas_mtime"] == os.path.getmtime(reas_filename) and \
+                    os.path.exists(row["inp_path"]) and row["inp_mtime"] == os.path.getmtime(row["inp_path"]):
+                continue
+
+            try:
+                entry = parse_simulation(reas_filename)
+            except (Exception, SystemExit) as e:
+                if verbose:
+                    print("Skipping %s: %s" % (reas_filename, e))
+                if row is not None:
+                    # do not keep the parameters of the previous version of a modified shower
+                    connection.execute("DELETE FROM simulations WHERE reas_path = ?", (reas_filename,))
+                    removed.append(reas_filename)
+                continue
+
+            connection.execute("INSERT OR REPLACE INTO simulations (%s) VALUES (%s)" %
+                               (", ".join('"%s"' % key for key in entry), ", ".join(["?"] * len(entry))), list(entry.values()))
+            n_updated += 1
+
+        # remove showers of this directory tree which were deleted
+        top = os.path.join(os.path.abspath(directory), "")
+        deleted = [path for path in known if path.startswith(top) and not os.path.exists(path)]
+        connection.executemany("DELETE FROM simulations WHERE reas_path = ?", [(path,) for path in deleted])
+        removed += deleted
+
+    connection.close()
+
+    if verbose:
+        print("Catalog %s: %i showers added or updated, %i removed" % (filename, n_updated, len(removed)))
+    return n_updated, len(removed)
+
+
+def get_simulations(directory, filename=None, pattern="**/SIM??????.reas", verbose=True):
+    """
+    Returns the catalog entries of the showers in the directory tree (.reas files matching pattern) as dict by
+    reas_path, after updating the catalog. If the catalog cannot be written (e.g. a read-only simulation library),
+    the showers are parsed directly instead.
+    """
+    if filename is None:
+        filename = get_catalog_filename(directory)
+
+    try:
+        update_catalog(directory, filename, pattern=pattern, verbose=verbose)
+        rows = query_catalog(filename)
+    except (sqlite3.Error, OSError) as e:
+        if verbose:
+            print("Could not update the catalog %s (%s), reading the showers without it" % (filename, e))
+        rows = []
+        for reas_filename in sorted(glob.glob(os.path.join(directory, pattern), recursive=True)):
+            try:
+                rows.append(parse_simulation(reas_filename))
+            except (Exception, SystemExit) as e:
+                if verbose:
+                    print("Skipping %s: %s" % (reas_filename, e))
+
+    return {row["reas_path"]: row for row in rows}
+
+
+def query_catalog(filename, order_by="reas_path", **conditions):
+    """
+    Returns the showers of the catalog (list of dicts, with the columns of catalog_columns) matching all conditions.
+    A condition is a value (equal), a tuple (minimum, maximum) (inclusive) or a list of values, e.g.
+
+    query_catalog("simulation_catalog.sqlite", zenith=(60, 80), primary=[14, 5626])
+    """
+    names = [name for name, _ in catalog_columns]
+    clauses = []
+    values = []
+    for key, value in conditions.items():
+        if key not in names:
+            sys.exit("Unknown column %s of the simulation catalog, use one of %s" % (key, names))
+        if isinstance(value, tuple):
+            clauses.append('"%s" BETWEEN ? AND ?' % key)
+            values += list(value)
+        elif isinstance(value, list):
+            clauses.append('"%s" IN (%s)' % (key, ", ".join(["?"] * len(value))))
+            values += value
+        else:
+            clauses.append('"%s" = ?' % key)
+            values.append(value)
+
+    if order_by not in names:
+        sys.exit("Unknown column %s of the simulation catalog, use one of %s" % (order_by, names))
+
+    query = "SELECT * FROM simulations"
+    if len(clauses):
+        query += " WHERE " + " AND ".join(clauses)
+    query += ' ORDER BY "%s"' % order_by
+
+    connection = open_catalog(filename)
+    rows = [dict(row) for row in connection.execute(query, values)]
+    connection.close()
+    return rows
+
+
+# * * * * * * * * * * * * * * * * *
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("--directory", "--dir", "-d", type="str", dest="directory",
+                      help="Specify the path to the simulation library (the .reas files can be in any subdirectory).")
+    parser.add_option("--catalog", "-c", type="str", dest="catalog",
+                      help="Optional: The catalog file. Default: simulation_catalog.sqlite in the directory.")
+    parser.add_option("--zenith", type="float", nargs=2, dest="zenith",
+                      help="Optional: Only list showers with zenith angles (in degrees) between the two values.")
+    parser.add_option("--primary", type="int", dest="primary",
+                      help="Optional: Only list showers of this primary (CORSIKA particle code).")
+
+    (options, args) = parser.parse_args()
+
+    if options.directory is None:
+        sys.exit("Specify the directory of the simulation library with --directory")
+
+    catalog = options.catalog or get_catalog_filename(options.directory)
+    update_catalog(options.directory, catalog)
+
+    conditions = {}
+    if options.zenith is not None:
+        conditions["zenith"] = tuple(options.zenith)
+    if options.primary is not None:
+        conditions["primary"] = options.primary
+
+    def format_value(form, value):
+        return form % value if value is not None else "-"
+
+    for row in query_catalog(catalog, **conditions):
+        print("%s  zenith %5.1f  azimuth %s  energy %s GeV  primary %s  obslevel %8.0f cm  atm %s" %
+              (row["reas_path"], row["zenith"], format_value("%5.1f", row["azimuth"]), format_value("%.2e", row["energy"]),
+               format_value("%4i", row["primary"]), row["obslevel"], format_value("%2i", row["atmosphere"])))
@@ -6,11 +6,14 @@
 # co-author: Lukas Gülzow, @lguelzow
 
 import numpy as np
-from utils.coordtransform import cstransform
+from utils.coordtransform import get_cstransform
 from utils.coordtransform import spherical_to_cartesian
 from utils.cherenkov_radius import get_cherenkov_radius_model_from_depth
+from utils.atmosphere import get_atmosphere_model, get_default_cache_directory
 import sys
-from radiotools.atmosphere import models
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor
 
 def create_stshp_list(zenith, azimuth, filename="antenna.list", 
                         obslevel=156400.0, # default for Dunhuang, !!in cm!!
@@ -20,7 +23,10 @@ def create_stshp_list(zenith, azimuth, filename="antenna.list",
                         Rmin=0., Rmax=50000., n_rings=30, # for positions in starshape !!in cm!!
                         antenna_rings=None, # predefined ring radii for antenna
                         arm_orientations=np.deg2rad([0, 45, 90, 135, 180, 225, 270, 315]), # for positions in starshape (in degrees)
-                        vxB_plot=False
+                        vxB_plot=False,
+                        dtype=np.float64, # precision of the generated positions
+                        reduced_arms=False, # only generate the arms in [0, 180] degrees
+                        binary_file=None # optional .npz or .hdf5 file for the structured array of get_stshp_array
                         ):
 
     """
@@ -37,8 +43,10 @@ def create_stshp_list(zenith, azimuth, filename="antenna.list",
                If the file is supposed to be used with the 
                radio_mpi Corsika generator (https://github.com/fedbont94/Horeka/tree/radio_mpi),
                keep the default filename.
-    obslevel :  float (!!in cm!!)
+    obslevel :  float or list of floats (!!in cm!!)
                Observation level of the detector in the vertical direction
+               If a list is given, the starshapes of all observation levels are written into the same file
+               (one plane per level, the level is part of the antenna names). The geometry is computed only once.
     obsplane :  string
                possible options are:
                   "gp" for antennas positioned on the ground plane
@@ -55,6 +63,95 @@ def create_stshp_list(zenith, azimuth, filename="antenna.list",
             Do not change unless you know what you are doing!
     antenna_rings :  array of antenna ring radii (in cm!)
          predefined list of antenna ring radii
+    dtype :  numpy floating point type (default np.float64)
+            precision in which the positions are calculated and written, e.g. np.float32.
+            With np.float32 the positions deviate by less than ~2.4e-7 times their distance
+            from the origin from the float64 result, i.e. < 0.1 mm for a 500 m starshape at 1.5 km altitude.
+    reduced_arms :  bool (default: False)
+                   if True, only the arms with orientations in [0, 180] degrees are generated (5 instead of 8 arms for
+                   the default orientations). In the vxB, vxvxB plane the arms at -phi are mirror images of the arms at phi
+                   across the vxB axis, the missing arms can be reconstructed from the simulation with arm_symmetry.py
+    vxB_plot :  bool (default: False)
+               if True, the antenna positions in vxB, vxvxB, v coordinates (in cm) are additionally written to
+               shower.list, one line per antenna with its name. The positions are relative to the core (0, 0, obslevel).
+               Before, shower.list contained the vxB transform of the absolute ground positions (shifted by the
+               transform of (0, 0, obslevel)) and the name of the last antenna on every line.
+    binary_file :  string (optional)
+                  if given, the structured array of get_stshp_array (positions in ground and vxB coordinates,
+                  names, ring radii, arm orientations) is additionally saved to this file (.npz or .hdf5),
+                  it can be loaded much faster than the text file with load_stshp_array
+    """
+    stshp, corsika_azimuth = get_stshp_array(zenith, azimuth, obslevel=obslevel, obsplane=obsplane,
+                                             Auger_CS=Auger_CS, inclination=inclination,
+                                             Rmin=Rmin, Rmax=Rmax, n_rings=n_rings, antenna_rings=antenna_rings,
+                                             arm_orientations=arm_orientations, dtype=dtype,
+                                             reduced_arms=reduced_arms, verbose=True)
+
+    write_stshp_list(filename, stshp)
+    print("Saved antenna positions (in groundplane coordinates) to file: ", filename)
+
+
+    # in case you want to plot the antennas in the shower plane coordinate system
+    if vxB_plot==True:
+        # open the shower.list file to save the generated starshapes to
+        # positions in cm
+        with open("shower.list", "w") as file:
+            file.write("".join([f"AntennaPosition = {x} {y} {z} {name}\n"
+                                for (x, y, z), name in zip(stshp["position_vxB"].tolist(), stshp["name"])]))
+
+        print("Saved antenna positions (in vxB_vxvxB coordinates) to file: ", "shower.list")
+
+    if binary_file is not None:
+        save_stshp_array(binary_file, stshp)
+        print("Saved antenna positions (structured array) to file: ", binary_file)
+
+
+    # return corsika azimuth angle to for automatically generating corsika input files with the right values
+    return corsika_azimuth
+
+
+def write_stshp_list(filename, stshp):
+    """ writes the ground positions (in cm) and names of a starshape structured array (see get_stshp_array)
+    to an antenna.list file for CoREAS """
+    # single write of the whole file
+    with open(filename, "w") as file:
+        file.write("".join([f"AntennaPosition = {x} {y} {z} {name}\n"
+                            for (x, y, z), name in zip(stshp["position"].tolist(), stshp["name"])]))
+
+
+def get_stshp_array(zenith, azimuth,
+                    obslevel=156400.0, # default for Dunhuang, !!in cm!!
+                    obsplane = "gp",
+                    Auger_CS = True, 
+                    inclination=61.60523, # default for Dunhuang (in degrees)
+                    Rmin=0., Rmax=50000., n_rings=30, # for positions in starshape !!in cm!!
+                    antenna_rings=None, # predefined ring radii for antenna
+                    arm_orientations=np.deg2rad([0, 45, 90, 135, 180, 225, 270, 315]), # for positions in starshape (in degrees)
+                    dtype=np.float64, # precision of the generated positions
+                    reduced_arms=False, # only generate the arms in [0, 180] degrees
+                    verbose=False
+                    ):
+
+    """
+    Generates the antennas of a starshape in memory.
+    The parameters are the same as for create_stshp_list (without filename, vxB_plot and binary_file).
+    If verbose is True, the information about the input processing is printed.
+
+    All antennas are transformed at once. The positions agree with the former antenna-by-antenna generator to
+    ~4e-16 times their size (< 1e-9 cm) but are not bit-identical, so antenna.list files differ in the last
+    digits (and e.g. -2.0890893521548434e-29 becomes 0.0).
+
+    Returns
+    -------
+    stshp :  numpy structured array with one entry per antenna (in the order of the antenna.list file) and the fields
+             "name" :  antenna name, e.g. pos_<radius>_<arm>_<obslevel>_<obsplane>
+             "position" :  position (3,) in ground coordinates as written to the antenna.list file (in cm)
+             "position_vxB" :  position (3,) in vxB, vxvxB, v coordinates relative to the core (0, 0, obslevel) (in cm),
+                               as written to the shower.list file
+             "ring_radius" :  radius of the antenna ring in the shower plane (in cm)
+             "arm_orientation" :  angle of the arm in the shower plane (in radians)
+             "obslevel" :  observation level (in cm)
+    corsika_azimuth :  the azimuth angle for the Corsika input file (in degrees)
     """
 
     # convert to rad for numpy calculations
@@ -66,8 +163,9 @@ def create_stshp_list(zenith, azimuth, filename="antenna.list",
     declination = np.deg2rad(0.12532) # default value is for Dunhuang
 
     # print information about input processing
-    print(f"Generating antenna positions in {obsplane} at {obslevel} cm.")
-    print(f"zenith: {np.rad2deg(zenith)} degrees - in Corsika convention")
+    if verbose:
+        print(f"Generating antenna positions in {obsplane} at {obslevel} cm.")
+        print(f"zenith: {np.rad2deg(zenith)} degrees - in Corsika convention")
 
     # define angle for Auger rotation 
     # set as 0 degrees if you want normal Corsika input
@@ -79,7 +177,8 @@ def create_stshp_list(zenith, azimuth, filename="antenna.list",
           # save corsika azimuth angle for output
           corsika_azimuth = np.round(np.rad2deg(azimuth) - 270, decimals=2)
           # print Corsika input angle for Auger input
-          print(f"azimuth: {corsika_azimuth} degrees - in Corsika convention")
+          if verbose:
+              print(f"azimuth: {corsika_azimuth} degrees - in Corsika convention")
 
 
     elif Auger_CS == False:
@@ -88,14 +187,16 @@ def create_stshp_list(zenith, azimuth, filename="antenna.list",
           # save corsika azimuth angle for output
           corsika_azimuth = np.round(np.rad2deg(azimuth) - 180, decimals=2)
           # print Corsika input angle
-          print(f"azimuth: {corsika_azimuth} degrees - in Corsika convention")
+          if verbose:
+              print(f"azimuth: {corsika_azimuth} degrees - in Corsika convention")
 
     
     else:  # dealing with wrong input choices:
         sys.exit("Invalid input. Possible options for Auger_CS are 'True' or 'False'. \n Quitting...")
 
 
-    print("These are the angles that should go into the Corsika input file!!!")
+    if verbose:
+        print("These are the angles that should go into the Corsika input file!!!")
 
 
     # rotation matrix for transformation between Auger and Corsika coordinate system
@@ -106,34 +207,39 @@ def create_stshp_list(zenith, azimuth, filename="antenna.list",
     
     # inverse rotation matrix for magnetic field vector
     inverse_rotation = np.linalg.inv(rotation_z_axis)
+    rotation_z_axis = rotation_z_axis.astype(dtype)
 
 
     # compute the B field in Corsika system (x direction = North, y direction = West)
     B_field = np.array([np.cos(inclination), 0, -np.sin(inclination)])
-    print("Magnetic field vector: ", B_field)
-    print("Magnetic field inclination", np.rad2deg(inclination))
+    if verbose:
+        print("Magnetic field vector: ", B_field)
+        print("Magnetic field inclination", np.rad2deg(inclination))
     
     # rotate magnetic field vector vertical axis in opposite direction of station coordinates
     # depends on Auger_CS
     B_field = np.dot(inverse_rotation, B_field)
 
     
-    # define coordinate system transformations
-    cst = cstransform(zenith = zenith,
-                      azimuth= azimuth,
-                      declination=declination, # for Dunhuang
-                      inclination=inclination,
-                      magnetic_field_vector=B_field # for Dunhuang
-                      )
+    # define coordinate system transformations (cached for repeated geometries)
+    cst = get_cstransform(zenith = zenith,
+                          azimuth= azimuth,
+                          declination=declination, # for Dunhuang
+                          inclination=inclination,
+                          magnetic_field_vector=B_field, # for Dunhuang
+                          dtype=dtype
+                          )
 
     # TODO: add obslevel corsika to inputs
     # compute translation in x and y
-    r = np.tan(zenith) * obslevel
+    obslevels = np.atleast_1d(np.asarray(obslevel, dtype=float))
+    r = np.tan(zenith) * obslevels
     dx = np.cos(azimuth) * r
     dy = np.sin(azimuth) * r
 
-    # array to save all station positions in
-    station_positions_groundsystem = []
+    # dealing with wrong obsplanes:
+    if obsplane not in ["gp", "sp"]:
+        sys.exit("Wrong choice of observation plane. Possible options are 'gp' or 'sp'. \n Quitting...")
 
     # check whether antenna ring radii are provided by input
     if antenna_rings is None:
@@ -144,129 +250,574 @@ def create_stshp_list(zenith, azimuth, filename="antenna.list",
         n_rings = len(antenna_rings)
         antenna_rings = np.append(0, antenna_rings)
 
+    # generate all station positions in shower plane coordinates at once
+    # shape (number of rings, number of arms, 3), ordered ring by ring like the antenna.list file
+    rings = antenna_rings[1:n_rings + 1]
+    arm_orientations = np.asarray(arm_orientations)
+
+    # the arms in (180, 360) degrees are mirror images of the arms in (0, 180) degrees across the vxB axis
+    if reduced_arms:
+        arm_orientations = arm_orientations[np.mod(arm_orientations, 2 * np.pi) <= np.pi + 1e-9]
+        if verbose:
+            print(f"Generating only the {len(arm_orientations)} arms in [0, 180] degrees")
+    arm_directions = spherical_to_cartesian(np.full(len(arm_orientations), np.pi * 0.5), arm_orientations)
+    station_positions = (rings[:, np.newaxis, np.newaxis] * arm_directions[np.newaxis]).reshape(-1, 3)
+
+    # all observation levels share the same geometry, shape (number of levels, number of antennas, 3)
+    # ground plane:
+    if obsplane == "gp":
+        # transform station positions to ground plane coordinates and
+        # set the z coordinates to the observation levels
+        station_positions_groundsystem = cst.transform_from_vxB_vxvxB_2D(station_positions, obs_levels=obslevels)
+
+    # shower plane:
+    else:
+        # transform station positions to ground plane coordinates and
+        # add observation levels to z coordinate
+        positions_showerplane = np.atleast_2d(cst.transform_from_vxB_vxvxB(station_positions))
+        station_positions_groundsystem = np.repeat(positions_showerplane[np.newaxis], len(obslevels), axis=0)
+        station_positions_groundsystem[..., 2] += obslevels[:, np.newaxis]
+
+    station_positions_groundsystem = station_positions_groundsystem.reshape(-1, 3)
+
+    # apply rotation matrix to stations
+    # Corsika input will stay the same, Auger input will be rotated by -90 degrees
+    positions = np.matmul(station_positions_groundsystem, rotation_z_axis.T)
+
+    ring_names = ["%i" % radius for radius in rings]
+    arm_names = ["%i" % angle for angle in np.rad2deg(arm_orientations)]
+    level_names = ["%.0f" % level for level in obslevels]
+    names = ["pos_%s_%s_%s_%s" % (ring_name, arm_name, level_name, obsplane)
+             for level_name in level_names for ring_name in ring_names for arm_name in arm_names]
+
+    n_arms = len(arm_orientations)
+
+    # transform the station positions to vxB system, relative to the core (0, 0, obslevel) of their level
+    cores = np.zeros(station_positions_groundsystem.shape, dtype=station_positions_groundsystem.dtype)
+    cores[:, 2] = np.repeat(obslevels, n_rings * n_arms)
+    shower_plane_system = np.atleast_2d(cst.transform_to_vxB_vxvxB(station_positions_groundsystem - cores))
+    stshp = np.zeros(len(names), dtype=[("name", "U%i" % max(len(name) for name in names)),
+                                        ("position", dtype, (3,)), ("position_vxB", dtype, (3,)),
+                                        ("ring_radius", dtype), ("arm_orientation", dtype), ("obslevel", dtype)])
+    stshp["name"] = names
+    stshp["position"] = positions
+    stshp["position_vxB"] = shower_plane_system
+    stshp["ring_radius"] = np.tile(np.repeat(rings, n_arms), len(obslevels))
+    stshp["arm_orientation"] = np.tile(arm_orientations, n_rings * len(obslevels))
+    stshp["obslevel"] = np.repeat(obslevels, n_rings * n_arms)
+
+    return stshp, corsika_azimuth
+
+
+def save_stshp_array(filename, stshp):
+    """
+    Saves a starshape structured array (see get_stshp_array) in a binary format.
 
-    # open the antenna.list file to save the generated starshapes to
-    with open(filename, "w") as file:
-        for i in np.arange(1, n_rings + 1): # loop over number of antenna rings
-                for j in np.arange(len(arm_orientations)): # loop over number of arms
-                        # generate station positions in shower plane coordinates
-                        station_position = antenna_rings[i] * spherical_to_cartesian(np.pi * 0.5, arm_orientations[j])
-                        name = "pos_%i_%i_%.0f_%s" % (antenna_rings[i], np.rad2deg(arm_orientations[j]), obslevel, obsplane)
-
-                        # ground plane:
-                        if obsplane == "gp":
-                                # transform station positions to ground plane coordinates and set all the z coordinates to 0
-                                pos_2d = cst.transform_from_vxB_vxvxB_2D(station_position)
-                                # pos_2d[0] += dx
-                                # pos_2d[1] += dy
-                                
-                                # write transformed coordinates into kartesian vector and 
-                                # set z coordinate to observation level
-                                gp_position = np.array([pos_2d[0], pos_2d[1], obslevel])
-
-                                # write all station positions into list for plot in vxB coordinates
-                                station_positions_groundsystem.append(gp_position)
-
-                                # apply rotation matrix to stations
-                                # Corsika input will stay the same, Auger input will be rotated by -90 degrees
-                                gp_position = np.dot(rotation_z_axis, gp_position)
-
-                                # save the generated starshapes to the antenna.list file
-                                # positions in cm
-                                file.write(f"AntennaPosition = {gp_position[0]} {gp_position[1]} {gp_position[2]} {name}\n")
-
-                        # shower plane:
-                        elif obsplane == "sp":
-                                # transform station positions to ground plane coordinates
-                                pos = cst.transform_from_vxB_vxvxB(station_position)
-                                # pos[0] += dx
-                                # pos[1] += dy
-
-                                # write transformed coordinates into kartesian vector and 
-                                # add observation level to z coordinate
-                                sp_position = np.array([pos[0], pos[1], (pos[2] + obslevel)])
-
-                                # write all station positions into list for plot in vxB coordinates
-                                station_positions_groundsystem.append(sp_position)
-
-                                # apply rotation matrix to stations
-                                # Corsika input will stay the same, Auger input will be rotated by -90 degrees
-                                sp_position = np.dot(rotation_z_axis, sp_position)
-
-                                # save the generated starshapes to the antenna.list file
-                                # positions in cm
-                                file.write(f"AntennaPosition = {sp_position[0]} {sp_position[1]} {sp_position[2]} {name}\n")
-                        
-                        # dealing with wrong obsplanes:
-                        else:
-                                sys.exit("Wrong choice of observation plane. Possible options are 'gp' or 'sp'. \n Quitting...")
-
-        print("Saved antenna positions (in groundplane coordinates) to file: ", filename)
+    Parameters
+    ----------
+    filename :  string
+               files ending with ".hdf5" or ".h5" are written with h5py (one dataset per field),
+               all others as numpy ".npz" file
+    stshp :  structured array returned by get_stshp_array
+    """
+    if os.path.splitext(filename)[1] in [".hdf5", ".h5"]:
+        import h5py
+        with h5py.File(filename, "w") as file:
+            for key in stshp.dtype.names:
+                values = stshp[key]
+                if key == "name":  # h5py does not support numpy unicode arrays
+                    values = np.char.encode(values, "utf-8")
+                file.create_dataset(key, data=values)
+    else:
+        np.savez(filename, stshp=stshp)
+
+
+def load_stshp_array(filename):
+    """ Loads a starshape structured array saved with save_stshp_array (.npz or .hdf5) """
+    if os.path.splitext(filename)[1] in [".hdf5", ".h5"]:
+        import h5py
+        with h5py.File(filename, "r") as file:
+            names = np.char.decode(file["name"][...], "utf-8")
+            fields = ["position", "position_vxB", "ring_radius", "arm_orientation", "obslevel"]
+            stshp = np.zeros(len(names), dtype=[("name", names.dtype)] +
+                             [(key, file[key].dtype, file[key].shape[1:]) for key in fields])
+            stshp["name"] = names
+            for key in fields:
+                stshp[key] = file[key][...]
+        return stshp
+
+    with np.load(filename) as file:
+        return file["stshp"]
+
+
+def _create_stshp_run(run):
+    """ worker for create_stshp_library: generates the starshape of one run, returns its manifest entry """
+    parameters = dict(run["parameters"])
+    parameters.pop("vxB_plot", None)  # all runs would write the same shower.list
+    filename = os.path.join(run["directory"], run["filename"])
+    if parameters.get("binary_file") is not None:
+        # written to the run directory as the antenna list, otherwise all runs would write the same file
+        parameters["binary_file"] = os.path.join(run["directory"], os.path.basename(parameters["binary_file"]))
+    os.makedirs(run["directory"], exist_ok=True)
+
+    # same as create_stshp_list, without its printout (summarized in the manifest instead)
+    generator_parameters = dict(parameters)
+    binary_file = generator_parameters.pop("binary_file", None)
+    stshp, corsika_azimuth = get_stshp_array(**generator_parameters)
+    write_stshp_list(filename, stshp)
+    if binary_file is not None:
+        save_stshp_array(binary_file, stshp)
+
+    entry = {"run": run["run"], "directory": run["directory"], "filename": filename,
+             "corsika_azimuth": float(corsika_azimuth), "n_antennas": len(stshp)}
+    for key, value in parameters.items():
+        if isinstance(value, np.ndarray):
+            value = value.tolist()
+        elif isinstance(value, np.generic):
+            value = value.item()
+        elif isinstance(value, (type, np.dtype)):  # e.g. dtype=np.float32
+            value = np.dtype(value).name
+        entry[key] = value
+    return entry
+
+
+def create_stshp_library(geometries, directory, filename="antenna.list", n_processes=None,
+                         manifest="manifest.json", **kwargs):
+    """
+    Generates the starshape antenna lists for a whole simulation library in parallel.
 
+    Parameters
+    ----------
+    geometries :  table of geometries, either a dict of equally long arrays, a numpy structured array
+                  or a list of dicts. Each row needs at least "zenith" and "azimuth" (in degrees) and can contain
+                  any other parameter of create_stshp_list (e.g. "obslevel", "obsplane", "antenna_rings").
+                  An optional "run" column sets the name of the run directory (default: running number "000000", ...).
+    directory :  string
+                 the antenna lists are written to <directory>/<run>/<filename>
+    filename :  string
+               name of the antenna list in each run directory
+    n_processes :  int (optional)
+                  number of worker processes, defaults to the number of CPUs
+    manifest :  string or None
+               name of the JSON summary written to <directory>, None to skip it
+    kwargs :  parameters passed to create_stshp_list for all runs (overwritten by the columns of `geometries`)
+             vxB_plot is not supported, since all runs would write the same shower.list.
+             binary_file is the name of the binary file in each run directory (as filename)
+
+    Returns
+    -------
+    corsika_azimuths :  array of the Corsika azimuth angles of all runs (in the order of `geometries`)
+    entries :  list of dicts, the manifest with run, directory, filename, Corsika azimuth,
+              number of antennas and all parameters of each run
+    """
 
-    # in case you want to plot the antennas in the shower plane coordinate system
-    if vxB_plot==True:
-        # open the shower.list file to save the generated starshapes to
-        with open("shower.list", "w") as file:
-                
-            # transform the station positions to vxB system for plot
-            shower_plane_system = cst.transform_to_vxB_vxvxB(np.array(station_positions_groundsystem))
-         
-            for i in range(len(shower_plane_system)):
-                # save the generated starshapes to the antenna.list file
-                # positions in cm
-                file.write(f"AntennaPosition = {shower_plane_system[i, 0]} {shower_plane_system[i, 1]} {shower_plane_system[i, 2]} {name}\n")
-            
-            print("Saved antenna positions (in vxB_vxvxB coordinates) to file: ", "shower.list")
+    # normalize the table to a list of dicts
+    if isinstance(geometries, dict):
+        columns = list(geometries.keys())
+        rows = [dict(zip(columns, values)) for values in zip(*[geometries[key] for key in columns])]
+    elif isinstance(geometries, np.ndarray) and geometries.dtype.names is not None:
+        rows = [{key: row[key] for key in geometries.dtype.names} for row in geometries]
+    else:
+        rows = [dict(row) for row in geometries]
 
+    kwargs.pop("vxB_plot", None)
 
-    # return corsika azimuth angle to for automatically generating corsika input files with the right values
-    return corsika_azimuth
+    runs = []
+    for i, row in enumerate(rows):
+        run = str(row.pop("run", "%06i" % i))
+        parameters = dict(kwargs)
+        parameters.update(row)
+        runs.append({"run": run, "directory": os.path.join(directory, run), "filename": filename,
+                     "parameters": parameters})
+
+    print(f"Generating starshapes for {len(runs)} runs in {directory}")
+
+    with ProcessPoolExecutor(max_workers=n_processes) as executor:
+        chunksize = max(1, len(runs) // (4 * (n_processes or os.cpu_count() or 1)))
+        entries = list(executor.map(_create_stshp_run, runs, chunksize=chunksize))
+
+    if manifest is not None:
+        manifest_filename = os.path.join(directory, manifest)
+        with open(manifest_filename, "w") as file:
+            json.dump(entries, file, indent=1)
+        print("Saved summary of all runs to file: ", manifest_filename)
+
+    corsika_azimuths = np.array([entry["corsika_azimuth"] for entry in entries])
+
+    return corsika_azimuths, entries
 
 
 def get_rmax(X):
     """ returns maximum axis distance in meter for a given simulation as
-    function of the atmosphere X in g/cm2 for a given atmosphere (and zenith angle) """
+    function of the atmosphere X in g/cm2 for a given atmosphere (and zenith angle),
+    X can be a scalar or an array """
     # rough hardcoded parametrisation...
-    return -148 + 0.712 * X
+    return -148 + 0.712 * np.asarray(X)
 
 
-def get_starshaped_pattern_radii(zenith, obs_level, at=None, atm_model=None):
-    # This is just validated for has shower
-    # is not even sopisticated
+# refractive index at sea level for Dunhuang
+n0_Dunhuang = 1.0002734814461
 
-    # convert zenith angle to radians for use in functions
-    zenith = np.deg2rad(zenith)
+# depth of the shower maximum used for the cherenkov radius (in g/cm²)
+# uses 750 g/cm² as a roughly correct value
+# THIS IS ONLY (APPROX.) VALID FOR PROTONS AT ENERGIES: 10e16 - 10e19 eV
+depth_cherenkov = 750
+
+# atmosphere model used for the cherenkov radius
+atm_model_cherenkov = 41
 
+
+def get_antenna_rings(rmax, cherenkov_radius):
+    """ returns the ring radii (in cm) of the starshaped pattern for a given maximum axis distance rmax (in cm)
+    and cherenkov radius (in m) """
+    # works for scalars and arrays, for arrays the rings are along the last axis
+    rmax = np.asarray(rmax)
+    r_cherenkov_upper_limit = (np.asarray(cherenkov_radius) * 1.23 + 80) * 100 # convert to cm for output
+
+    # create list of antenna rings with denser rings within cherenkov radius and a little beyond
+    antenna_rings = np.concatenate([
+                   (0.005 * rmax)[..., np.newaxis],
+                   np.linspace(0.01 * rmax, r_cherenkov_upper_limit, 14, endpoint=False, axis=-1),
+                   np.linspace(r_cherenkov_upper_limit, rmax, 15, axis=-1)], axis=-1)
+
+    return antenna_rings
+
+
+def get_pattern_limits(zenith, obs_level, at=None, atm_model=None):
+    """
+    Returns the maximum axis distance rmax (in cm) and the cherenkov radius (in m) of the starshaped pattern.
+
+    Parameters
+    ----------
+    zenith :  float or array, zenith angle(s) in degrees
+    obs_level :  float or array, observation level(s) in cm (broadcasted against zenith)
+    at :  radiotools.atmosphere.models.Atmosphere (optional), used for rmax
+    atm_model :  int, model index of the atmosphere if at is not given
+
+    Returns
+    -------
+    rmax, cherenkov_radius :  scalars or arrays with the broadcasted shape of zenith and obs_level
+    """
+    # convert zenith angle to radians for use in functions
     #TODO: add error that catches when input is in wrong unit
-    obs_level = obs_level / 100 # convert from cm to m
+    # convert observation level from cm to m
+    zenith, obs_level = np.broadcast_arrays(np.deg2rad(np.asarray(zenith, dtype=float)),
+                                            np.asarray(obs_level, dtype=float) / 100)
 
     if at is None:
         if atm_model is None:
             sys.exit("No proper arguments for get_starshaped_pattern_radii")
 
-        at = models.Atmosphere(atm_model)
+        at = get_atmosphere_model(atm_model)
 
-    # calculate maximum distance of antenna from shower core (in shower plane)
-    # uses rough, hardcoded parametrisation
-    maxX = at.get_atmosphere(zenith, obs_level)
-    rmax = get_rmax(maxX) * 100 # convert to cm for output
+    # one (shared) atmosphere for the cherenkov radius of all geometries
+    at_cherenkov = get_atmosphere_model(atm_model_cherenkov)
 
-    # refractive index at sea level for Dunhuang
-    n0_Dunhuang = 1.0002734814461
+    rmax = np.zeros(zenith.shape)
+    cherenkov_radius = np.zeros(zenith.shape)
 
-    # calculate cherenkov radius from zenith angle, depth of maximum, observation level, and atmosphere model
-    # uses 750 g/cm² as a roughly correct value
-    # THIS IS ONLY (APPROX.) VALID FOR PROTONS AT ENERGIES: 10e16 - 10e19 eV
-    cherenkov_radius = get_cherenkov_radius_model_from_depth(zenith=zenith, depth=750, obs_level=obs_level, n0=n0_Dunhuang, model=41) # returns in m
+    # radiotools takes arrays of zenith angles, but only one observation level per call
+    for level in np.unique(obs_level):
+        mask = obs_level == level
 
-    r_cherenkov_upper_limit = (cherenkov_radius * 1.23 + 80) * 100 # convert to cm for output
+        # calculate maximum distance of antenna from shower core (in shower plane)
+        # uses rough, hardcoded parametrisation
+        maxX = at.get_atmosphere(zenith[mask], level)
+        rmax[mask] = get_rmax(maxX) * 100 # convert to cm for output
+
+        # calculate cherenkov radius from zenith angle, depth of maximum, observation level, and atmosphere model
+        cherenkov_radius[mask] = get_cherenkov_radius_model_from_depth(
+            zenith=zenith[mask], depth=depth_cherenkov, obs_level=level, n0=n0_Dunhuang, at=at_cherenkov) # returns in m
+
+    return rmax, cherenkov_radius
+
+
+def get_starshaped_pattern_radii(zenith, obs_level, at=None, atm_model=None):
+    """
+    Returns the ring radii (in cm) of the starshaped pattern.
+    This is just validated for has shower and is not even sophisticated.
+
+    Parameters
+    ----------
+    zenith :  float or array, zenith angle(s) in degrees
+    obs_level :  float or array, observation level(s) in cm (broadcasted against zenith)
+    at :  radiotools.atmosphere.models.Atmosphere (optional), used for rmax
+    atm_model :  int, model index of the atmosphere if at is not given
+
+    Returns
+    -------
+    antenna_rings :  array with the shape (n_rings,) for scalar input or (M, n_rings) for M geometries
+    """
+    rmax, cherenkov_radius = get_pattern_limits(zenith, obs_level, at=at, atm_model=atm_model)
 
-    # create list of antenna rings with denser rings within cherenkov radius and a little beyond
-    antenna_rings = np.append(0.005 * rmax, np.append(
-                   np.linspace(0.01 * rmax, r_cherenkov_upper_limit, 14, endpoint=False),
-                   np.linspace(r_cherenkov_upper_limit, rmax, 15)))
-    
     # all lengths here are converted to cm for the input of the starshape generator function
 
-    return antenna_rings
+    return get_antenna_rings(rmax, cherenkov_radius)
+
+
+def get_lateral_profile(r, cherenkov_radius):
+    """ returns the lateral profile of the energy fluence in the shower plane (arbitrary units)
+    at the axis distance r for a given cherenkov radius (same unit as r):
+    a Gaussian ring at the cherenkov radius on top of an exponential fall off """
+    # rough hardcoded parametrisation...
+    r = np.asarray(r)
+    return np.exp(-0.5 * ((r - cherenkov_radius) / (0.4 * cherenkov_radius)) ** 2) + \
+        0.3 * np.exp(-r / cherenkov_radius)
+
+
+def get_azimuthal_profile(arm_orientation, charge_excess_fraction, sin_geomagnetic_angle):
+    """ returns the azimuthal dependence of the energy fluence in the shower plane (normalised to a maximum of 1)
+    from the interference of the geomagnetic and charge excess emission, arm_orientation in radians
+    (0 = vxB direction). charge_excess_fraction is a = sin(alpha) * E_ce / E_geo """
+    k = charge_excess_fraction / sin_geomagnetic_angle
+    return (1 + 2 * k * np.cos(arm_orientation) + k ** 2) / (1 + k) ** 2
+
+
+def get_sin_geomagnetic_angle(zenith, azimuth, inclination=61.60523, Auger_CS=True):
+    """ returns the sine of the angle between shower axis and magnetic field for the conventions of
+    create_stshp_list (angles in degrees) """
+    zenith = np.deg2rad(zenith)
+    azimuth = np.deg2rad(azimuth)
+    inclination = np.deg2rad(inclination)
+
+    # compute the B field in Corsika system (x direction = North, y direction = West)
+    # and rotate it like in create_stshp_list
+    B_field = np.array([np.cos(inclination), 0, -np.sin(inclination)])
+    if Auger_CS:
+        rot_angle = np.deg2rad(270)
+        B_field = np.dot(np.array([[np.cos(rot_angle), np.sin(rot_angle), 0],
+                                   [-np.sin(rot_angle), np.cos(rot_angle), 0],
+                                   [0, 0, 1]]), B_field)
+
+    return np.linalg.norm(np.cross(spherical_to_cartesian(zenith, azimuth), B_field))
+
+
+def get_adaptive_stshp_layout(zenith, azimuth, obs_level=156400.0, inclination=61.60523, Auger_CS=True,
+                              atm_model=41, target_error=0.05, charge_excess_fraction=0.14,
+                              max_rings=100, max_arms=32, verbose=True):
+    """
+    Chooses the ring radii and arm orientations of a starshape such that a linear interpolation of the
+    energy fluence between the antennas deviates by less than target_error (relative to the maximum fluence)
+    from the parametrised footprint. The footprint is the product of get_lateral_profile with the
+    cherenkov radius of get_pattern_limits and get_azimuthal_profile, half of the error budget
+    is spent on the rings and half on the arms.
+
+    Rings are placed with a density proportional to the square root of the curvature of the lateral profile,
+    i.e. densely around the cherenkov ring and sparsely in the tail, from 0.005 * rmax to rmax. Their number
+    is increased until the interpolation error of the lateral profile is below target_error / 2.
+    The number of arms is the smallest multiple of 4 for which the linear interpolation of the azimuthal
+    profile is accurate enough.
+
+    Parameters
+    ----------
+    zenith, azimuth :  angles in degrees, as for create_stshp_list
+    obs_level :  observation level in cm
+    inclination :  inclination of the magnetic field in degrees
+    Auger_CS :  bool, coordinate system as for create_stshp_list
+    atm_model :  int, model index of the atmosphere for rmax
+    target_error :  float, maximum interpolation error relative to the maximum fluence
+    charge_excess_fraction :  float, relative strength of the charge excess emission (typically 0.1 - 0.2)
+    max_rings, max_arms :  upper limits for the number of rings and arms
+
+    Returns
+    -------
+    antenna_rings :  ring radii in cm (input for antenna_rings of create_stshp_list)
+    arm_orientations :  arm orientations in radians (input for arm_orientations of create_stshp_list)
+    n_antennas :  expected number of antennas per observation level
+    """
+    rmax, cherenkov_radius = get_pattern_limits(zenith, obs_level, atm_model=atm_model)
+    cherenkov_radius = cherenkov_radius * 100 # convert to cm
+
+    # rings: equidistribute the spacing sqrt(8 * error / |f''|) of a linear interpolation
+    r = np.linspace(0.005 * rmax, rmax, 10000)
+    profile = get_lateral_profile(r, cherenkov_radius)
+    norm = profile.max()
+    profile = profile / norm
+    curvature = np.abs(np.gradient(np.gradient(profile, r), r))
+    ring_density = np.sqrt(np.maximum(curvature, 1e-30) / (8 * target_error / 2))
+    ring_density = np.maximum(ring_density, 4 / rmax) # at least one ring per quarter of the pattern
+    n_cumulative = np.append(0, np.cumsum(0.5 * (ring_density[1:] + ring_density[:-1]) * np.diff(r)))
+
+    n_rings = max(2, int(np.ceil(n_cumulative[-1])))
+    while True:
+        antenna_rings = np.interp(np.linspace(0, n_cumulative[-1], n_rings), n_cumulative, r)
+        ring_profile = get_lateral_profile(antenna_rings, cherenkov_radius) / norm
+        ring_error = np.max(np.abs(np.interp(r, antenna_rings, ring_profile) - profile))
+        if ring_error <= target_error / 2 or n_rings >= max_rings:
+            break
+        n_rings += 1
+
+    # arms: the maximum curvature of the azimuthal profile is 2k / (1 + k)^2
+    sin_alpha = get_sin_geomagnetic_angle(zenith, azimuth, inclination=inclination, Auger_CS=Auger_CS)
+    sin_alpha_safe = max(sin_alpha, 1e-3) # showers along the magnetic field
+    k = charge_excess_fraction / sin_alpha_safe
+    arm_spacing = np.sqrt(8 * target_error / 2 * (1 + k) ** 2 / (2 * k))
+    n_arms = int(min(max_arms, max(4, 4 * np.ceil(2 * np.pi / arm_spacing / 4))))
+    arm_orientations = np.arange(n_arms) * 2 * np.pi / n_arms
+
+    phi = np.linspace(0, 2 * np.pi, 3601)
+    arms_closed = np.append(arm_orientations, 2 * np.pi)
+    arm_profile = get_azimuthal_profile(arms_closed, charge_excess_fraction, sin_alpha_safe)
+    arm_error = np.max(np.abs(np.interp(phi, arms_closed, arm_profile) -
+                              get_azimuthal_profile(phi, charge_excess_fraction, sin_alpha_safe)))
+
+    n_antennas = n_rings * n_arms
+
+    if verbose:
+        print(f"Adaptive starshape: {n_rings} rings x {n_arms} arms = {n_antennas} antennas "
+              f"(default: 30 rings x 8 arms = 240 antennas)")
+        print(f"rmax: {rmax / 100:.0f} m, cherenkov radius: {cherenkov_radius / 100:.0f} m, "
+              f"sin(geomagnetic angle): {sin_alpha:.3f}")
+        print(f"Expected interpolation error: rings {ring_error:.3f}, arms {arm_error:.3f} (target: {target_error})")
+
+    return antenna_rings, arm_orientations, n_antennas
+
+
+# version of the lookup table layout, increase to force a rebuild of all saved tables
+_radii_table_version = 1
+
+# default grid of the lookup tables: zenith angles in degrees, observation levels in cm
+radii_table_zeniths = np.arange(0., 89.01, 0.5)
+radii_table_obs_levels = np.arange(0., 500001., 50000.)
+
+# lookup tables already loaded in this process, by file name
+_radii_tables = {}
+
+
+def get_radii_table_filename(atm_model):
+    """ returns the default file of the lookup table for an atmosphere model, the directory can be set
+    with the environment variable STARSHAPES_CACHE (default: ~/.cache/starshapes) """
+    return os.path.join(get_default_cache_directory(), "pattern_radii_atm%02i.npz" % atm_model)
+
+
+def _radii_table_parameters(atm_model, zeniths, obs_levels):
+    """ parameters which a saved lookup table has to match, otherwise it is rebuilt """
+    return {"version": _radii_table_version, "atm_model": atm_model,
+            "atm_model_cherenkov": atm_model_cherenkov, "depth_cherenkov": depth_cherenkov,
+            "n0": n0_Dunhuang, "zeniths": np.asarray(zeniths, dtype=float),
+            "obs_levels": np.asarray(obs_levels, dtype=float)}
+
+
+def build_radii_table(atm_model, zeniths=radii_table_zeniths, obs_levels=radii_table_obs_levels):
+    """
+    Calculates rmax and the cherenkov radius of get_starshaped_pattern_radii on a grid of zenith angles
+    and observation levels. Takes about a minute for the default grid, mostly for zenith angles above 80 degrees.
+
+    Parameters
+    ----------
+    atm_model :  int
+                 model index of the radiotools atmosphere used for rmax
+    zeniths :  array of zenith angles in degrees (ascending)
+    obs_levels :  array of observation levels in cm (ascending)
+
+    Returns
+    -------
+    table :  dict with the grid parameters and the arrays "rmax" (in cm) and "cherenkov_radius" (in m),
+             both with the shape (len(zeniths), len(obs_levels)), the cherenkov radius is NaN where the
+             shower maximum would be below the observation level
+    """
+    table = _radii_table_parameters(atm_model, zeniths, obs_levels)
+    zenith_rad = np.deg2rad(table["zeniths"])
+
+    at = get_atmosphere_model(atm_model)
+    at_cherenkov = get_atmosphere_model(atm_model_cherenkov)
+
+    rmax = np.zeros((len(zenith_rad), len(table["obs_levels"])))
+    cherenkov_radius = np.zeros_like(rmax)
+    for i, obs_level in enumerate(table["obs_levels"] / 100): # convert from cm to m
+        rmax[:, i] = get_rmax(at.get_atmosphere(zenith_rad, obs_level)) * 100 # convert to cm
+
+        # the cherenkov radius is only defined if the shower maximum is above the observation level
+        above = at_cherenkov.get_atmosphere(zenith_rad, obs_level) > depth_cherenkov
+        cherenkov_radius[~above, i] = np.nan
+        if np.any(above):
+            cherenkov_radius[above, i] = get_cherenkov_radius_model_from_depth(
+                zenith=zenith_rad[above], depth=depth_cherenkov, obs_level=obs_level, n0=n0_Dunhuang, at=at_cherenkov)
+
+    table["rmax"] = rmax
+    table["cherenkov_radius"] = cherenkov_radius
+    return table
+
+
+def get_radii_table(atm_model, zeniths=radii_table_zeniths, obs_levels=radii_table_obs_levels, filename=None):
+    """
+    Returns the lookup table of build_radii_table. The table is read from filename
+    (default: get_radii_table_filename(atm_model)) and only (re)built and saved if the file
+    does not exist or was calculated with different parameters.
+    """
+    if filename is None:
+        filename = get_radii_table_filename(atm_model)
+
+    parameters = _radii_table_parameters(atm_model, zeniths, obs_levels)
+
+    def matches(table):
+        return all(np.shape(table[key]) == np.shape(value) and np.all(table[key] == value)
+                   for key, value in parameters.items())
+
+    if filename in _radii_tables and matches(_radii_tables[filename]):
+        return _radii_tables[filename]
+
+    table = None
+    if os.path.exists(filename):
+        with np.load(filename) as file:
+            table = {key: file[key] for key in file.files}
+        if not all(key in table for key in parameters) or not matches(table):
+            print("Parameters of the lookup table in %s changed, rebuilding it" % filename)
+            table = None
+
+    if table is None:
+        print("Calculating the lookup table of the starshape radii for atmosphere model %i" % atm_model)
+        table = build_radii_table(atm_model, zeniths, obs_levels)
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        np.savez(filename, **table)
+        print("Saved lookup table to file: ", filename)
+
+    _radii_tables[filename] = table
+    return table
+
+
+def get_starshaped_pattern_radii_from_table(zenith, obs_level, atm_model, filename=None,
+                                            zeniths=radii_table_zeniths, obs_levels=radii_table_obs_levels):
+    """
+    Same as get_starshaped_pattern_radii, but rmax and the cherenkov radius are interpolated (bilinear)
+    from the lookup table of get_radii_table instead of being calculated with the atmosphere model.
+    With the default grid the ring radii deviate from get_starshaped_pattern_radii by less than 0.1%
+    for zenith angles up to 80 degrees and by less than 0.2% up to 85 degrees. Above, the cherenkov radius
+    of radiotools jumps between 87.5 and 88 degrees and the deviation reaches a few percent.
+
+    Only the limits rmax and cherenkov radius are tabulated, the rings are always placed with get_antenna_rings
+    (the ring definition of get_starshaped_pattern_radii, 30 rings). For other ring layouts, call get_pattern_limits
+    or interpolate get_radii_table yourself.
+
+    Parameters
+    ----------
+    zenith :  float or array, zenith angle(s) in degrees
+    obs_level :  float or array, observation level(s) in cm
+    atm_model :  int, model index of the radiotools atmosphere
+    filename :  string (optional), file of the lookup table
+    zeniths :  array (optional), zenith angles of the table grid in degrees (a different grid rebuilds the table)
+    obs_levels :  array (optional), observation levels of the table grid in cm
+
+    Returns
+    -------
+    antenna_rings :  ring radii in cm, the shape is (n_rings,) for scalar input or (M, n_rings)
+                     for M zenith angles / observation levels (broadcasted against each other)
+    """
+    from scipy.interpolate import RegularGridInterpolator
+
+    table = get_radii_table(atm_model, zeniths=zeniths, obs_levels=obs_levels, filename=filename)
+
+    zenith, obs_level = np.broadcast_arrays(np.asarray(zenith, dtype=float), np.asarray(obs_level, dtype=float))
+    if np.any((zenith < table["zeniths"][0]) | (zenith > table["zeniths"][-1]) |
+              (obs_level < table["obs_levels"][0]) | (obs_level > table["obs_levels"][-1])):
+        sys.exit("Zenith angle or observation level outside of the lookup table for get_starshaped_pattern_radii")
+
+    points = np.stack([zenith.ravel(), obs_level.ravel()], axis=-1)
+    grid = (table["zeniths"], table["obs_levels"])
+    rmax = RegularGridInterpolator(grid, table["rmax"])(points)
+    cherenkov_radius = RegularGridInterpolator(grid, table["cherenkov_radius"])(points)
+
+    if np.any(np.isnan(cherenkov_radius)):
+        sys.exit("Shower maximum below the observation level for some geometries in get_starshaped_pattern_radii_from_table")
+
+    return get_antenna_rings(rmax.reshape(zenith.shape), cherenkov_radius.reshape(zenith.shape))
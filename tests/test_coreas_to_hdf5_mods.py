@@ -0,0 +1,128 @@
+import os
+import subprocess
+import sys
+
+import h5py
+import numpy as np
+
+repository_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+converter_directory = os.path.join(repository_directory, "biohazard_do_not_open")
+sys.path.insert(0, repository_directory)
+sys.path.insert(0, converter_directory)
+
+from coreas_to_hdf5_mods import convert_plane_traces, read_observer_traces  # noqa: E402
+from utils.coordtransform import cstransform  # noqa: E402
+
+
+reas_file = """# CoREAS V1.4
+CoreCoordinateNorth = 0 ; in cm
+CoreCoordinateWest = 0 ; in cm
+CoreCoordinateVertical = 156400 ; in cm
+TimeResolution = 2e-10 ; in s
+AutomaticTimeBoundaries = 4e-07 ; 0: off
+TimeLowerBoundary = -1 ; in s
+TimeUpperBoundary = 1 ; in s
+ResolutionReductionScale = 5000 ; 0: off
+GroundLevelRefractiveIndex = 1.000292 ;
+CorsikaFilePath = ./
+CorsikaParameterFile = SIM000001.inp
+EventNumber = -1
+RunNumber = -1
+GPSSecs = 0
+GPSNanoSecs = 0
+CoreEastingOffline = 0
+CoreNorthingOffline = 0
+CoreVerticalOffline = 0
+RotationAngleForMagfieldDeclination = 0
+Comment =
+ShowerZenithAngle = 60
+ShowerAzimuthAngle = 30
+PrimaryParticleEnergy = 1e17
+PrimaryParticleType = 14
+DepthOfShowerMaximum = 700
+DistanceOfShowerMaximum = 50000
+MagneticFieldStrength = 0.5
+MagneticFieldInclinationAngle = 61.6
+"""
+
+inp_file = """RUNNR 1
+EVTNR 1
+PRMPAR 14
+ERANGE 1e8 1e8
+THETAP 60. 60.
+PHIP -240. -240.
+ECUTS 0.3 0.3 0.001 0.001
+OBSLEV 1564e2
+MAGNET 27.8 -51.5
+ATMOD 41
+"""
+
+
+def write_long_file(filename):
+    depths = np.arange(5, 1005, 5.)
+    particles = 1e7 * (depths / 700.) ** (700 / 60.) * np.exp((700 - depths) / 60.)
+    with open(filename, "w") as f:
+        f.write(" LONGITUDINAL DISTRIBUTION IN %5d SLANT  STEPS OF   5. G/CM**2 FOR SHOWER      1\n" % len(depths))
+        f.write(" DEPTH     GAMMAS   POSITRONS   ELECTRONS         MU+         MU-     HADRONS     CHARGED      NUCLEI   CHERENKOV\n")
+        for depth, n in zip(depths, particles):
+            f.write("%6.1f" % depth + "".join(" %11.5E" % v for v in [n, n / 10, n / 5, 1e3, 1e3, 10, n / 3, 0, n * 100]) + "\n")
+        f.write(" LONGITUDINAL ENERGY DEPOSIT IN %5d SLANT  STEPS OF   5. G/CM**2 FOR SHOWER      1\n" % len(depths))
+        f.write(" DEPTH       GAMMA    EM IONIZ      EM CUT    MU IONIZ      MU CUT  HADR IONIZ    HADR CUT   NEUTRINO         SUM\n")
+        for depth, n in zip(depths, particles):
+            f.write("%6.1f" % depth + "".join(" %11.5E" % v for v in [n * 1e-3, n * 1e-2, n * 1e-3, 1e-1, 1e-2, 1e-2, 1e-3, 1e-3, n * 1.2e-2]) + "\n")
+        f.write(" FIT OF THE HILLAS CURVE   N(T) = P1*((T-P2)/(P3-P2))**((P3-P2)/(P4+P5*T+P6*T**2)) * EXP((P3-T)/(P4+P5*T+P6*T**2))\n")
+        f.write(" TO LONGITUDINAL DISTRIBUTION OF    ALL CHARGED  PARTICLES\n")
+        f.write(" PARAMETERS         =   1.0000E+07 -1.2345E+01  7.0000E+02  6.0000E+01 -1.0000E-03  1.0000E-06\n")
+        f.write(" CHI**2/DOF         =   1.0\n")
+
+
+def write_ragged_simulation(directory, lengths=(2000, 1900, 1800)):
+    """ a small simulation whose antennas have traces of different lengths (as with ResolutionReductionScale) """
+    os.makedirs(os.path.join(directory, "SIM000001_coreas"))
+    with open(os.path.join(directory, "SIM000001.reas"), "w") as f:
+        f.write(reas_file)
+    with open(os.path.join(directory, "SIM000001.inp"), "w") as f:
+        f.write(inp_file)
+    write_long_file(os.path.join(directory, "DAT000001.long"))
+
+    rng = np.random.default_rng(1)
+    with open(os.path.join(directory, "SIM000001.list"), "w") as f:
+        for k in range(6):
+            radius, arm = 5000 * (k // 2 + 1), 180 * (k % 2)
+            name = "pos_%i_%i_156400_sp" % (radius, arm)
+            f.write("AntennaPosition = %.1f %.1f 156400.0 %s\n" % (radius * np.cos(np.deg2rad(arm)), radius * np.sin(np.deg2rad(arm)), name))
+
+            n_samples = lengths[k % len(lengths)]
+            times = -1e-7 + 2e-10 * np.arange(n_samples)
+            pulse = 1e-6 * np.exp(-0.5 * (times / 2e-9) ** 2)
+            efield = np.stack([0.8 * pulse, 0.3 * pulse, 0.1 * pulse], axis=1) + 1e-9 * rng.normal(size=(n_samples, 3))
+            np.savetxt(os.path.join(directory, "SIM000001_coreas", "raw_%s.dat" % name), np.column_stack([times, efield]))
+
+
+def test_highlevel_with_ragged_traces(tmp_path):
+    write_ragged_simulation(str(tmp_path))
+    subprocess.run([sys.executable, os.path.join(converter_directory, "coreas_to_hdf5_mods.py"),
+                    str(tmp_path / "SIM000001.reas"), "-hl", "--norad", "-o", str(tmp_path)],
+                   check=True, cwd=str(tmp_path), stdout=subprocess.DEVNULL)
+
+    with h5py.File(str(tmp_path / "SIM000001.hdf5"), "r") as f_h5:
+        traces = read_observer_traces(f_h5["CoREAS"], np.arange(6))
+        assert isinstance(traces, list)
+        assert sorted(set(len(trace) for trace in traces)) == [1800, 1900, 2000]
+
+    with h5py.File(str(tmp_path / "SIM000001_highlevel.hdf5"), "r") as f_h5:
+        fluence = f_h5["highlevel/obsplane_156400_sp_vB_vvB/energy_fluence"][:]
+        assert len(fluence) == 6
+        assert np.all(np.isfinite(fluence)) and np.all(fluence > 0)
+
+
+def test_convert_plane_traces_per_antenna():
+    rng = np.random.default_rng(2)
+    traces = rng.normal(size=(4, 50, 4))
+    ctrans = cstransform(np.deg2rad(60), np.deg2rad(30), magnetic_field_vector=np.array([0, 0.2, -0.4]))
+
+    times, efield = convert_plane_traces(traces, ctrans)
+    for i in range(len(traces)):
+        times_i, efield_i = convert_plane_traces(traces[i:i + 1], ctrans)
+        assert np.array_equal(times_i[0], times[i])
+        assert np.allclose(efield_i[0], efield[i], rtol=1e-14, atol=0)
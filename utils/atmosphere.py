@@ -0,0 +1,276 @@
+# Process-wide registry of radiotools atmosphere models.
+#
+# Creating a radiotools.atmosphere.models.Atmosphere reads (or calculates) the constants of the
+# curved atmosphere and sets up interpolations. The registry creates each model only once per process
+# and shares it between all functions and threads. Optionally, the created objects are also stored on disk.
+
+import numpy as np
+import hashlib
+import os
+import pickle
+import sys
+import threading
+
+from radiotools.atmosphere import models as atm
+
+
+_atmospheres = {}
+_atmospheres_lock = threading.Lock()
+_atmosphere_cache_directory = None
+
+
+def get_default_cache_directory():
+    """ Returns the directory for tables saved by this package: the environment variable STARSHAPES_CACHE
+    or ~/.cache/starshapes """
+    return os.environ.get("STARSHAPES_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "starshapes"))
+
+
+def set_atmosphere_cache_directory(directory):
+    """ Enables the on-disk cache of the atmosphere models in the given directory, None disables it (default) """
+    global _atmosphere_cache_directory
+    with _atmospheres_lock:
+        _atmosphere_cache_directory = directory
+
+
+def get_atmosphere_model(model=17, **kwargs):
+    """ Returns a (shared) radiotools Atmosphere for the given model.
+
+    The keyword arguments are passed to radiotools.atmosphere.models.Atmosphere (e.g. n0, curved, gdas_file),
+    each combination is created only once per process. The returned object must not be modified.
+
+    radiotools exits the program after it calculated the constants of a model for the first time
+    ("please rerun your analysis"), here the model is simply created again from the saved constants.
+    """
+    key = (model,) + tuple(sorted(kwargs.items()))
+
+    with _atmospheres_lock:
+        if key not in _atmospheres:
+            _atmospheres[key] = _load_or_create_atmosphere(model, kwargs, key)
+        return _atmospheres[key]
+
+
+def clear_atmosphere_registry():
+    """ Removes all atmosphere models from the registry (not from the disk cache) """
+    with _atmospheres_lock:
+        _atmospheres.clear()
+
+
+def _load_or_create_atmosphere(model, kwargs, key):
+    filename = None
+    if _atmosphere_cache_directory is not None:
+        name = hashlib.md5(repr(key).encode("utf-8")).hexdigest()[:16]
+        filename = os.path.join(_atmosphere_cache_directory, "atmosphere_%s.pkl" % name)
+        if os.path.exists(filename):
+            try:
+                with open(filename, "rb") as file:
+                    return pickle.load(file)
+            except Exception:
+                pass  # unreadable or outdated file, create the model again
+
+    at = None
+    for _ in range(3):
+        try:
+            at = atm.Atmosphere(model=model, **kwargs)
+            break
+        except SystemExit as e:
+            # radiotools exits after calculating new (or removing outdated) constants
+            if e.code not in (0, None):
+                raise
+    if at is None:
+        at = atm.Atmosphere(model=model, **kwargs)
+
+    if filename is not None:
+        os.makedirs(_atmosphere_cache_directory, exist_ok=True)
+        # write to a temporary file first, other processes may read the cache at the same time
+        tmp_filename = "%s.%i.tmp" % (filename, os.getpid())
+        with open(tmp_filename, "wb") as file:
+            pickle.dump(at, file)
+        os.replace(tmp_filename, filename)
+
+    return at
+
+
+#* * * * * * * * * * * * * * * * *
+
+"""
+Tables of the geometric distance between ground and a slant depth (e.g. Xmax) along the shower axis.
+"""
+
+# version of the distance table layout, increase to force a rebuild of all saved tables
+_distance_table_version = 2
+
+# default grid of the distance tables: zenith angles in degrees (denser towards the horizon),
+# slant depths in g/cm², observation levels in m
+distance_table_zeniths = np.concatenate([np.arange(0., 60., 0.5), np.arange(60., 80., 0.2), np.arange(80., 89.01, 0.1)])
+distance_table_depths = np.arange(0., 2000.1, 5.)
+distance_table_obs_levels = np.arange(0., 5000.1, 250.)
+
+# distance tables already opened in this process, by file name
+_distance_tables = {}
+_distance_tables_lock = threading.Lock()
+
+
+def build_distance_table(model, zeniths=distance_table_zeniths, depths=distance_table_depths,
+                         obs_levels=distance_table_obs_levels, filename=None):
+    """
+    Calculates the geometric distance between ground and a slant depth along the shower axis, as
+    radiotools.atmosphere.models.Atmosphere.get_distance_xmax_geometric (curved atmosphere), on a grid.
+
+    For every observation level the density of the atmosphere model is integrated once along the axes of all
+    zenith angles (trapezoidal rule in 10 m height steps), which gives the slant depth as function of the distance.
+    The distances of the depths of the grid are interpolated from it. They agree with radiotools to a few cm.
+    Depths beyond the ground are extrapolated linearly to negative distances (below the observation level),
+    so that the table can be interpolated up to the ground.
+
+    Parameters
+    ----------
+    model :  int, model index of the radiotools atmosphere
+    zeniths :  zenith angles in degrees (ascending)
+    depths :  slant depths in g/cm² (ascending)
+    obs_levels :  observation levels in m (ascending)
+    filename :  string (optional), if given the table is written to this .npy file (use np.load(..., mmap_mode="r"))
+
+    Returns
+    -------
+    table :  array with the shape (len(zeniths), len(depths), len(obs_levels)), distances in m,
+             negative where the depth is below the observation level
+    """
+    shape = (len(zeniths), len(depths), len(obs_levels))
+    if filename is None:
+        table = np.zeros(shape)
+    else:
+        table = np.lib.format.open_memmap(filename, mode="w+", dtype=np.float64, shape=shape)
+
+    zenith = np.deg2rad(np.asarray(zeniths, dtype=float))[:, np.newaxis]
+    depths = np.asarray(depths, dtype=float)
+    for i, obs_level in enumerate(obs_levels):
+        heights = np.append(np.arange(obs_level, atm.h_max, 10.), atm.h_max)
+        density = atm.get_density(heights, model=model)  # in g/m^3
+        distances = atm.get_distance_for_height_above_ground(heights - obs_level, zenith, obs_level)
+
+        # slant depth above each point of the axes, in g/cm^2
+        segments = 0.5 * (density[1:] + density[:-1]) * np.diff(distances, axis=1)
+        overburden = np.zeros(distances.shape)
+        overburden[:, :-1] = np.cumsum(segments[:, ::-1], axis=1)[:, ::-1] * 1e-4
+
+        for j in range(len(zenith)):
+            depth_axis = overburden[j, ::-1]
+            distance_axis = distances[j, ::-1]
+            column = np.interp(depths, depth_axis, distance_axis)
+
+            # beyond the ground: continue with the slope of the last step
+            below = depths > depth_axis[-1]
+            slope = (distance_axis[-1] - distance_axis[-2]) / (depth_axis[-1] - depth_axis[-2])
+            column[below] = distance_axis[-1] + slope * (depths[below] - depth_axis[-1])
+            table[j, :, i] = column
+
+    if filename is not None:
+        table.flush()
+    return table
+
+
+def get_distance_table(model, zeniths=distance_table_zeniths, depths=distance_table_depths,
+                       obs_levels=distance_table_obs_levels, filename=None):
+    """
+    Returns the grid and the (memory-mapped, read-only) table of build_distance_table.
+    The table is read from filename (default: distance_xmax_atm<model>.npy in get_default_cache_directory())
+    and only (re)built if the file does not exist or was calculated for a different grid. All processes
+    using the same file share the memory of the table.
+
+    Returns
+    -------
+    (zeniths, depths, obs_levels), table
+    """
+    if filename is None:
+        filename = os.path.join(get_default_cache_directory(), "distance_xmax_atm%02i.npy" % model)
+    grid_filename = os.path.splitext(filename)[0] + "_grid.npz"
+
+    grid = [np.asarray(x, dtype=float) for x in (zeniths, depths, obs_levels)]
+
+    def matches(saved):
+        return int(saved["version"]) == _distance_table_version and int(saved["model"]) == model and \
+            all(np.shape(saved[key]) == np.shape(value) and np.all(saved[key] == value)
+                for key, value in zip(["zeniths", "depths", "obs_levels"], grid))
+
+    with _distance_tables_lock:
+        if filename in _distance_tables and matches(_distance_tables[filename][0]):
+            saved, table = _distance_tables[filename]
+            return (saved["zeniths"], saved["depths"], saved["obs_levels"]), table
+
+        saved = None
+        if os.path.exists(filename) and os.path.exists(grid_filename):
+            with np.load(grid_filename) as file:
+                saved = {key: file[key] for key in file.files}
+            if not matches(saved):
+                print("Grid of the distance table in %s changed, rebuilding it" % filename)
+                saved = None
+
+        if saved is None:
+            # write to temporary files first, other processes may read the table at the same time
+            os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+            tmp_filename = "%s.%i.tmp.npy" % (os.path.splitext(filename)[0], os.getpid())
+            build_distance_table(model, *grid, filename=tmp_filename)
+            saved = {"version": _distance_table_version, "model": model,
+                     "zeniths": grid[0], "depths": grid[1], "obs_levels": grid[2]}
+            tmp_grid_filename = "%s.%i.tmp.npz" % (os.path.splitext(grid_filename)[0], os.getpid())
+            np.savez(tmp_grid_filename, **saved)
+            os.replace(tmp_filename, filename)
+            os.replace(tmp_grid_filename, grid_filename)
+
+        table = np.load(filename, mmap_mode="r")
+        _distance_tables[filename] = (saved, table)
+        return (saved["zeniths"], saved["depths"], saved["obs_levels"]), table
+
+
+def _get_interpolation_weights(grid, x, name):
+    if np.any((x < grid[0]) | (x > grid[-1])):
+        sys.exit("%s outside of the distance table (%g - %g)" % (name, grid[0], grid[-1]))
+    index = np.clip(np.searchsorted(grid, x, side="right") - 1, 0, len(grid) - 2)
+    return index, (x - grid[index]) / (grid[index + 1] - grid[index])
+
+
+def get_distance_xmax_geometric(zenith, depth, obs_level, model, filename=None):
+    """
+    Returns the geometric distance (in m) between ground and a point along the shower axis defined by its
+    slant depth, like radiotools.atmosphere.models.Atmosphere.get_distance_xmax_geometric, but interpolated
+    (trilinear) from the table of get_distance_table. Only the 8 neighbouring entries of the table are read for
+    each point, the time per point does not depend on the zenith angle.
+
+    The distance roughly scales with 1 / cos(zenith), so distance * cos(zenith) is interpolated.
+    With the default grid (model 41, 24000 random showers with zenith angles of 0 - 80 degrees, depths of
+    400 - 900 g/cm² and observation levels of 0 - 3000 m) the distances deviate from radiotools by less than
+    0.05% (median 0.008%, up to ~25 m at 100 km) for distances above 1 km, and by less than 0.5 m for shorter
+    distances (depths close to the ground, where the relative deviation can be large). For zenith angles of
+    80 - 88 degrees the deviations reach 0.11% (~200 m).
+    Depths beyond the ground (negative interpolated distance) give NaN.
+
+    Parameters
+    ----------
+    zenith :  float or array, zenith angle(s) in radians
+    depth :  float or array, slant depth(s) in g/cm²
+    obs_level :  float or array, observation level(s) in m
+    model :  int, model index of the radiotools atmosphere
+    filename :  string (optional), file of the table
+
+    Returns
+    -------
+    distance :  distance(s) in m with the broadcasted shape of zenith, depth and obs_level
+    """
+    (zeniths, depths, obs_levels), table = get_distance_table(model, filename=filename)
+
+    zenith, depth, obs_level = np.broadcast_arrays(np.rad2deg(np.asarray(zenith, dtype=float)),
+                                                   np.asarray(depth, dtype=float), np.asarray(obs_level, dtype=float))
+    i, wi = _get_interpolation_weights(zeniths, zenith.ravel(), "Zenith angle")
+    j, wj = _get_interpolation_weights(depths, depth.ravel(), "Slant depth")
+    k, wk = _get_interpolation_weights(obs_levels, obs_level.ravel(), "Observation level")
+
+    cos_zeniths = np.cos(np.deg2rad(zeniths))
+    distance = np.zeros(len(i))
+    for di, fi in [(0, 1 - wi), (1, wi)]:
+        for dj, fj in [(0, 1 - wj), (1, wj)]:
+            for dk, fk in [(0, 1 - wk), (1, wk)]:
+                distance += fi * fj * fk * cos_zeniths[i + di] * table[i + di, j + dj, k + dk]
+
+    distance /= np.cos(np.deg2rad(zenith.ravel()))
+    distance[distance < 0] = np.nan
+    return distance.reshape(zenith.shape)
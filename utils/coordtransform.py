@@ -11,6 +11,8 @@ import math
 from numpy.linalg import linalg
 import copy
 import sys
+import threading
+from collections import OrderedDict, namedtuple
 
 #* * * * * * * * * * * * * * * * * 
 
@@ -57,7 +59,8 @@ class cstransform():
     def __init__(self, zenith, azimuth, 
                  inclination=np.deg2rad(61.60523), # default for Dunhuang
                  declination=np.deg2rad(0.12532), # default for Dunhuang
-                 magnetic_field_vector=None):
+                 magnetic_field_vector=None,
+                 dtype=np.float64):
         
         """ Initialization with signal/air-shower direction and magnetic field configuration.
 
@@ -81,8 +84,17 @@ class cstransform():
         magnetic_field_vector (optional): 3-vector, default None
             the magnetic field vector in the cartesian ground coordinate system,
             if no magnetic field vector is specified, the value is calculated from the given inclination.
+
+        dtype (optional): numpy floating point type, default np.float64
+            precision in which positions and traces are transformed. The matrices are always
+            computed in double precision and rounded to this type when applied.
+            With np.float32 each transformed component deviates from the float64 result by at most
+            ~4 * 2^-24 (about 2.4e-7) times the norm of the input vector, plus the rounding of the
+            input itself, e.g. below 0.1 mm for positions within 500 m of the core.
         """
 
+        self.dtype = np.dtype(dtype)
+
         # v points along shower propagation direction
         showeraxis = -1 * spherical_to_cartesian(zenith, azimuth)  # -1 is because shower is propagating towards us
 
@@ -103,9 +115,9 @@ class cstransform():
         # print(e2)
         # print(e3)
 
+        # all transformation matrices are orthonormal, their inverses are given by the transposed matrices
         self.__transformation_matrix_vBvvB = copy.copy(np.matrix([e1, e2, e3]))
-        self.__inverse_transformation_matrix_vBvvB = np.linalg.inv(
-            self.__transformation_matrix_vBvvB)
+        self.__inverse_transformation_matrix_vBvvB = self.__transformation_matrix_vBvvB.T
 
         # initialize transformation matrix to on-sky coordinate system (er, etheta, ephi)
         ct = np.cos(zenith) # cosinus theta 
@@ -116,8 +128,7 @@ class cstransform():
         e2 = np.array([ct * cp, ct * sp, -st])
         e3 = np.array([-sp, cp, 0])
         self.__transformation_matrix_onsky = copy.copy(np.matrix([e1, e2, e3]))
-        self.__inverse_transformation_matrix_onsky = np.linalg.inv(
-            self.__transformation_matrix_onsky)
+        self.__inverse_transformation_matrix_onsky = self.__transformation_matrix_onsky.T
 
         # initialize transformation matrix from magnetic north to geographic north coordinate system
        
@@ -128,8 +139,7 @@ class cstransform():
         e3 = np.array([0, 0, 1])
         self.__transformation_matrix_magnetic = copy.copy(
             np.matrix([e1, e2, e3]))
-        self.__inverse_transformation_matrix_magnetic = np.linalg.inv(
-            self.__transformation_matrix_magnetic)
+        self.__inverse_transformation_matrix_magnetic = self.__transformation_matrix_magnetic.T
 
         # initialize transformation matrix from ground (geographic) cs to ground 
         # cs where x axis points into shower direction projected on ground
@@ -140,8 +150,7 @@ class cstransform():
         e3 = np.array([0, 0, 1])
         self.__transformation_matrix_azimuth = copy.copy(
             np.matrix([e1, e2, e3]))
-        self.__inverse_transformation_matrix_azimuth = np.linalg.inv(
-            self.__transformation_matrix_azimuth)
+        self.__inverse_transformation_matrix_azimuth = self.__transformation_matrix_azimuth.T
 
         # initialize transformation matrix from ground (geographic) cs to shower plane (early-late) cs
         # rotation along z axis -> shower axis along y axis
@@ -159,13 +168,12 @@ class cstransform():
                         [0, s, c]])
 
         self.__transformation_matrix_early_late = copy.copy(np.matmul(e2, e1))
-        self.__inverse_transformation_matrix_early_late = np.linalg.inv(
-            self.__transformation_matrix_early_late)
+        self.__inverse_transformation_matrix_early_late = self.__transformation_matrix_early_late.T
 
 
 
     def __transform(self, positions, matrix):
-        return np.squeeze(np.asarray(np.dot(matrix, positions)))
+        return np.squeeze(np.dot(np.asarray(matrix, dtype=self.dtype), np.asarray(positions, dtype=self.dtype)))
 
     def transform_from_ground_to_onsky(self, positions):
         """ on sky coordinates are eR, eTheta, ePhi """
@@ -189,62 +197,61 @@ class cstransform():
 
 
 
-    def transform_from_early_late(self, positions, core=None):
-        """ transform a single station position or a list of multiple
-        station positions back to x,y,z CS
+    def __transform_stations(self, positions, matrix, core=None, add_core=False, out=None):
+        """ transform a single station position (3,) or a list of station positions (N, 3)
+        with a single matrix product.
+
+        If `core` is given, it is subtracted from the positions before the transformation
+        (add_core=False) or added to the transformed positions afterwards (add_core=True).
+        The input positions are never modified. If `out` is given, the result is written
+        into this buffer (with the shape (N, 3), or (3,) for a single position).
         """
-        # to keep positions constant (for the outside)
-        if(core is not None):
-            positions = np.array(copy.deepcopy(positions))
+        positions = np.asarray(positions, dtype=self.dtype)
 
         # if a single station position is transformed: (3,) -> (1, 3)
         if positions.ndim == 1:
             positions = np.expand_dims(positions, axis=0)
+            if out is not None:
+                out = np.expand_dims(out, axis=0)
 
-        _, nY = positions.shape
-        if(nY != 3):
+        if positions.ndim != 2 or positions.shape[1] != 3:
             sys.exit("Illegal position given")
-        else:
-            result = []
-            for pos in positions:
-                temp = self.__transform(
-                    pos, self.__inverse_transformation_matrix_early_late)
-                if(core is not None):
-                    result.append(temp + core)
-                else:
-                    result.append(temp)
 
-            return np.squeeze(np.array(result))
+        if core is not None:
+            core = np.asarray(core, dtype=self.dtype)
+
+        # subtracting the core creates a new array, so the positions stay constant (for the outside)
+        if core is not None and not add_core:
+            positions = positions - core
 
+        result = np.matmul(positions, np.asarray(matrix, dtype=self.dtype).T, out=out)
 
+        if core is not None and add_core:
+            result += core
 
-    def transform_to_early_late(self, positions, core=None):
+        return np.squeeze(result)
+
+
+
+    def transform_from_early_late(self, positions, core=None, out=None):
         """ transform a single station position or a list of multiple
-        station positions into the shower plane system
+        station positions back to x,y,z CS
         """
-        # to keep positions constant (for the outside)
-        if(core is not None):
-            positions = np.array(copy.deepcopy(positions))
+        return self.__transform_stations(positions, self.__inverse_transformation_matrix_early_late,
+                                         core=core, add_core=True, out=out)
 
-        # if a single station position is transformed: (3,) -> (1, 3)
-        if positions.ndim == 1:
-            positions = np.expand_dims(positions, axis=0)
 
-        _, nY = positions.shape
-        if(nY != 3):
-            sys.exit("Illegal position given")
-        else:
-            result = []
-            for pos in positions:
-                if(core is not None):
-                    pos -= core
-                result.append(self.__transform(
-                    pos, self.__transformation_matrix_early_late))
-            return np.squeeze(np.array(result))
+
+    def transform_to_early_late(self, positions, core=None, out=None):
+        """ transform a single station position or a list of multiple
+        station positions into the shower plane system
+        """
+        return self.__transform_stations(positions, self.__transformation_matrix_early_late,
+                                         core=core, out=out)
 
 
 
-    def transform_to_vxB_vxvxB(self, station_position, core=None):
+    def transform_to_vxB_vxvxB(self, station_position, core=None, out=None):
         """ transform a single station position or a list of multiple
         station positions into vxB, vxvxB shower plane
 
@@ -256,29 +263,20 @@ class cstransform():
         Note: this logic will fail if a trace will have a shape of (3, 3), which is however
         unlikely to happen.
 
+        A list of station positions is transformed with a single matrix product.
+        If `out` is given, the transformed positions are written into this buffer.
         """
-        # to keep station_position constant (for the outside)
-        if(core is not None):
-            station_position = np.array(copy.deepcopy(station_position))
-
-        # if a single station position is transformed: (3,) -> (1, 3)
-        if station_position.ndim == 1:
-            station_position = np.expand_dims(station_position, axis=0)
+        station_position = np.asarray(station_position)
 
-        nX, nY = station_position.shape
-        if(nY != 3):
+        if station_position.ndim == 2 and station_position.shape[1] != 3:
             return self.__transform(station_position, self.__transformation_matrix_vBvvB)
-        else:
-            result = []
-            for pos in station_position:
-                if(core is not None):
-                    pos -= core
-                result.append(self.__transform(pos, self.__transformation_matrix_vBvvB))
-            return np.squeeze(np.array(result))
+
+        return self.__transform_stations(station_position, self.__transformation_matrix_vBvvB,
+                                         core=core, out=out)
 
 
 
-    def transform_from_vxB_vxvxB(self, station_position, core=None):
+    def transform_from_vxB_vxvxB(self, station_position, core=None, out=None):
         """ transform a single station position or a list of multiple
         station positions back to x,y,z CS
 
@@ -289,55 +287,193 @@ class cstransform():
         this dimension is '3', a list of station positions is assumed to be the input.
         Note: this logic will fail if a trace will have a shape of (3, 3), which is however
         unlikely to happen.
+
+        A list of station positions is transformed with a single matrix product.
+        If `out` is given, the transformed positions are written into this buffer.
         """
+        station_position = np.asarray(station_position)
 
-        # to keep station_position constant (for the outside)
-        if(core is not None):
-            station_position = np.array(copy.deepcopy(station_position))
+        if station_position.ndim == 2 and station_position.shape[1] != 3:
+            return self.__transform(station_position, self.__inverse_transformation_matrix_vBvvB)
 
-        # if a single station position is transformed: (3,) -> (1, 3)
-        if station_position.ndim == 1:
-            station_position = np.expand_dims(station_position, axis=0)
+        return self.__transform_stations(station_position, self.__inverse_transformation_matrix_vBvvB,
+                                         core=core, add_core=True, out=out)
 
-        nX, nY = station_position.shape
-        if(nY != 3):
-            return self.__transform(station_position, self.__inverse_transformation_matrix_vBvvB)
+
+
+    def __transform_traces(self, traces, matrix, dtype=None, inplace=False, chunk_size=2**16):
+        """ rotate the polarizations of an electric-field tensor with the shape (..., 3),
+        e.g. (number of antennas, length of trace, 3), with a single matrix product.
+
+        The last dimension is always interpreted as the polarization.
+        If `inplace` is True, `traces` (a C-contiguous ndarray) is overwritten block by block
+        (`chunk_size` samples at a time), so no temporary copy of the full tensor is created.
+        """
+        if not inplace:
+            traces = np.asarray(traces)
+        if dtype is None:
+            dtype = traces.dtype if np.issubdtype(traces.dtype, np.floating) else self.dtype
+        matrix = np.asarray(matrix, dtype=dtype)
+
+        if inplace:
+            if not isinstance(traces, np.ndarray) or not traces.flags.c_contiguous or traces.dtype != dtype:
+                sys.exit("In-place transformation requires a C-contiguous array of type %s" % np.dtype(dtype))
         else:
-            result = []
-            for pos in station_position:
-                temp = self.__transform(
-                    pos, self.__inverse_transformation_matrix_vBvvB)
-                if(core is not None):
-                    result.append(temp + core)
-                else:
-                    result.append(temp)
+            traces = traces.astype(dtype, copy=False)
+
+        if traces.ndim < 1 or traces.shape[-1] != 3:
+            sys.exit("Illegal trace given, the last dimension has to be the polarization (3)")
+
+        flat = traces.reshape(-1, 3)
+        if not inplace:
+            return np.matmul(flat, matrix.T).reshape(traces.shape)
+
+        for start in range(0, len(flat), chunk_size):
+            block = flat[start:start + chunk_size]
+            block[...] = np.matmul(block, matrix.T)
+        return traces
+
+
+
+    def transform_traces_to_vxB_vxvxB(self, traces, dtype=None, inplace=False):
+        """ rotate electric-field traces with the shape (..., 3), typically
+        (number of antennas, length of trace, 3), into the vxB, vxvxB, v polarizations
+
+        Parameters
+        ----------
+        traces : array (..., 3)
+            electric field, the last dimension is the polarization in the x,y,z CS
+        dtype : numpy dtype (optional)
+            precision of the calculation, e.g. np.float32. Defaults to the type of the traces
+            (the dtype of the cstransform for non floating point input)
+        inplace : bool (default False)
+            overwrite `traces` with the rotated traces instead of returning a new array
+        """
+        return self.__transform_traces(traces, self.__transformation_matrix_vBvvB, dtype=dtype, inplace=inplace)
+
+
 
-            return np.squeeze(np.array(result))
+    def transform_traces_from_vxB_vxvxB(self, traces, dtype=None, inplace=False):
+        """ rotate electric-field traces with the shape (..., 3) from the vxB, vxvxB, v
+        polarizations back to the x,y,z CS (see transform_traces_to_vxB_vxvxB) """
+        return self.__transform_traces(traces, self.__inverse_transformation_matrix_vBvvB, dtype=dtype, inplace=inplace)
 
 
 
-    def transform_from_vxB_vxvxB_2D(self, station_position, core=None):
+    def transform_dataset(self, source, destination, transformation="to_vxB_vxvxB", core=None, chunk_size=2**16):
+        """ transform a dataset that does not fit into memory chunk by chunk
+
+        Parameters
+        ----------
+        source : h5py.Dataset or array-like with the shape (N, ..., 3)
+            station positions (N, 3) or electric-field traces (N, length of trace, 3),
+            the last dimension is always the coordinate/polarization. Read along the first axis.
+        destination : h5py.Dataset or array-like with the same shape as `source`
+            receives the transformed data, written along the first axis
+        transformation : string
+            one of "to_vxB_vxvxB", "from_vxB_vxvxB", "to_early_late", "from_early_late",
+            "ground_to_onsky", "onsky_to_ground"
+        core : 3-vector (optional)
+            subtracted before transformations into ("to_...") and added after transformations
+            out of ("from_...") the shower plane, only meaningful for positions
+        chunk_size : int
+            maximum number of 3-vectors held in the working buffers at once
+
+        Returns
+        -------
+        destination
+        """
+        matrices = {
+            "to_vxB_vxvxB": (self.__transformation_matrix_vBvvB, False),
+            "from_vxB_vxvxB": (self.__inverse_transformation_matrix_vBvvB, True),
+            "to_early_late": (self.__transformation_matrix_early_late, False),
+            "from_early_late": (self.__inverse_transformation_matrix_early_late, True),
+            "ground_to_onsky": (self.__transformation_matrix_onsky, False),
+            "onsky_to_ground": (self.__inverse_transformation_matrix_onsky, True),
+        }
+        if transformation not in matrices:
+            sys.exit("Unknown transformation '%s'. Possible options are: %s" % (transformation, ", ".join(matrices)))
+        matrix, add_core = matrices[transformation]
+
+        shape = tuple(source.shape)
+        if shape[-1] != 3 or tuple(destination.shape) != shape:
+            sys.exit("Illegal dataset given, expected source and destination with the same shape (N, ..., 3)")
+
+        dtype = getattr(destination, "dtype", self.dtype)
+        if not np.issubdtype(dtype, np.floating):
+            dtype = self.dtype
+        matrix = np.asarray(matrix, dtype=dtype)
+
+        # number of rows (along the first axis) per chunk
+        vectors_per_row = int(np.prod(shape[1:-1], dtype=int))
+        rows = max(1, chunk_size // max(1, vectors_per_row))
+
+        # working buffers are allocated once and reused for every chunk
+        buffer_in = np.empty((min(rows, shape[0]),) + shape[1:], dtype=dtype)
+        buffer_out = np.empty_like(buffer_in)
+
+        for start in range(0, shape[0], rows):
+            stop = min(start + rows, shape[0])
+            n = stop - start
+
+            if hasattr(source, "read_direct"):  # h5py datasets read directly into the buffer
+                source.read_direct(buffer_in, np.s_[start:stop], np.s_[0:n])
+            else:
+                buffer_in[:n] = source[start:stop]
+
+            if core is not None and not add_core:
+                buffer_in[:n] -= core
+
+            np.matmul(buffer_in[:n].reshape(-1, 3), matrix.T, out=buffer_out[:n].reshape(-1, 3))
+
+            if core is not None and add_core:
+                buffer_out[:n] += core
+
+            destination[start:stop] = buffer_out[:n]
+
+        return destination
+
+
+
+    def transform_from_vxB_vxvxB_2D(self, station_position, core=None, obs_levels=None):
         """ transform a single station position or a list of multiple
-        station positions back to x,y,z CS """
-        # to keep station_position constant (for the outside)
-        if(core is not None):
-            station_position = np.array(copy.deepcopy(station_position))
+        station positions in the vxB, vxvxB plane back to x,y,z CS, projected onto the ground
+
+        The heights in the shower plane are computed for all (x, y) pairs at once and
+        the positions are projected to the ground with a single matrix product.
+
+        Parameters
+        ----------
+        station_position : array with the shape (2,), (3,), (N, 2) or (N, 3)
+            positions in the vxB, vxvxB plane, only the first two coordinates are used
+        core : 3-vector (optional)
+            added to the projected positions
+        obs_levels : float or array of floats (optional)
+            observation levels (in the units of the positions). If given, the z coordinate
+            of the projected positions is set to each observation level (plus the z coordinate
+            of the core) and an array with the shape (number of levels, N, 3) is returned.
+        """
+        station_position = np.asarray(station_position, dtype=self.dtype)
 
         # if a single station position is transformed: (3,) -> (1, 3)
         if station_position.ndim == 1:
             station_position = np.expand_dims(station_position, axis=0)
 
-        result = []
-        for pos in station_position:
-            position = np.array(
-                [pos[0], pos[1], self.get_height_in_showerplane(pos[0], pos[1])])
-            pos_transformed = self.__transform(
-                position, self.__inverse_transformation_matrix_vBvvB)
-            if(core is not None):
-                pos_transformed += core
-            result.append(pos_transformed)
+        x = station_position[:, 0]
+        y = station_position[:, 1]
+        positions = np.column_stack([x, y, self.get_height_in_showerplane(x, y)]).astype(self.dtype, copy=False)
+
+        result = np.matmul(positions, np.asarray(self.__inverse_transformation_matrix_vBvvB, dtype=self.dtype).T)
+        if core is not None:
+            result += core
 
-        return np.squeeze(np.array(result))
+        if obs_levels is None:
+            return np.squeeze(result)
+
+        obs_levels = np.atleast_1d(np.asarray(obs_levels, dtype=float))
+        result = np.repeat(result[np.newaxis], len(obs_levels), axis=0)
+        result[..., 2] = obs_levels[:, np.newaxis] + (0 if core is None else core[2])
+        return result
 
 
 
@@ -368,3 +504,339 @@ class cstransform():
                 theta_1 = -1. * math.pi * 0.5
                 psi_1 = -phi_1 + math.atan2(-R[0, 1], -R[0, 2])
         return psi_1, theta_1, phi_1
+
+
+
+#* * * * * * * * * * * * * * * * *
+
+"""
+Memoized construction of cstransform objects, e.g. for dense zenith/azimuth grids with repeated geometries.
+"""
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+_cstransform_cache = OrderedDict()
+_cstransform_cache_lock = threading.Lock()
+_cstransform_cache_maxsize = 256
+_cstransform_cache_hits = 0
+_cstransform_cache_misses = 0
+
+
+def get_cstransform(zenith, azimuth,
+                    inclination=np.deg2rad(61.60523), # default for Dunhuang
+                    declination=np.deg2rad(0.12532), # default for Dunhuang
+                    magnetic_field_vector=None,
+                    dtype=np.float64):
+    """ Returns a (shared) cstransform object for the given geometry.
+
+    The objects are kept in a least-recently-used cache keyed on
+    (zenith, azimuth, inclination, declination, magnetic field vector, dtype).
+    The parameters are the same as for cstransform. The returned object must not be modified.
+    """
+    global _cstransform_cache_hits, _cstransform_cache_misses
+
+    if magnetic_field_vector is not None:
+        magnetic_field_vector = tuple(np.asarray(magnetic_field_vector, dtype=float).ravel())
+    key = (float(zenith), float(azimuth), float(inclination), float(declination), magnetic_field_vector, np.dtype(dtype).str)
+
+    with _cstransform_cache_lock:
+        if key in _cstransform_cache:
+            _cstransform_cache_hits += 1
+            _cstransform_cache.move_to_end(key)
+            return _cstransform_cache[key]
+        _cstransform_cache_misses += 1
+
+    cst = cstransform(zenith, azimuth, inclination=inclination, declination=declination,
+                      magnetic_field_vector=None if magnetic_field_vector is None else np.array(magnetic_field_vector),
+                      dtype=dtype)
+
+    with _cstransform_cache_lock:
+        _cstransform_cache[key] = cst
+        while len(_cstransform_cache) > _cstransform_cache_maxsize:
+            _cstransform_cache.popitem(last=False)
+
+    return cst
+
+
+def set_cstransform_cache_size(maxsize):
+    """ Sets the maximum number of cached cstransform objects (least recently used ones are dropped first) """
+    global _cstransform_cache_maxsize
+    with _cstransform_cache_lock:
+        _cstransform_cache_maxsize = int(maxsize)
+        while len(_cstransform_cache) > _cstransform_cache_maxsize:
+            _cstransform_cache.popitem(last=False)
+
+
+def cstransform_cache_info():
+    """ Returns the hits, misses, maximum and current size of the cstransform cache """
+    with _cstransform_cache_lock:
+        return CacheInfo(_cstransform_cache_hits, _cstransform_cache_misses,
+                         _cstransform_cache_maxsize, len(_cstransform_cache))
+
+
+def clear_cstransform_cache():
+    """ Empties the cstransform cache and resets its counters """
+    global _cstransform_cache_hits, _cstransform_cache_misses
+    with _cstransform_cache_lock:
+        _cstransform_cache.clear()
+        _cstransform_cache_hits = 0
+        _cstransform_cache_misses = 0
+
+
+
+#* * * * * * * * * * * * * * * * *
+
+"""
+The following class is a companion of cstransform for many geometries at once.
+"""
+
+def _stacked_rotation_z(angle):
+    """ stacked rotation matrices (M, 3, 3) around the z axis for an array of angles (in radians) """
+    c = np.cos(angle)
+    s = np.sin(angle)
+    matrices = np.zeros((len(angle), 3, 3))
+    matrices[:, 0, 0] = c
+    matrices[:, 0, 1] = -s
+    matrices[:, 1, 0] = s
+    matrices[:, 1, 1] = c
+    matrices[:, 2, 2] = 1
+    return matrices
+
+
+
+class cstransform_stack():
+
+    """ class to perform the coordinate transformations of cstransform for M geometries at once
+
+    All transformation matrices are stored as stacks with the shape (M, 3, 3) and are applied
+    to position or trace tensors with the shape (M, ..., 3) with a single (batched) matrix product.
+    A tensor with the shape (1, ..., 3) is transformed into all M coordinate systems.
+
+    All rotation matrices are orthonormal, their inverses are obtained by transposition.
+    """
+
+    def __init__(self, zenith, azimuth,
+                 inclination=np.deg2rad(61.60523), # default for Dunhuang
+                 declination=np.deg2rad(0.12532), # default for Dunhuang
+                 magnetic_field_vector=None,
+                 dtype=np.float64):
+
+        """ Initialization with arrays of signal/air-shower directions and magnetic field configurations.
+
+        All parameters should be specified according to CORSIKA conventions.
+
+        Parameters
+        ----------
+        zenith : array of floats (in radians), shape (M,)
+            zenith angles of the incoming signal/air-shower directions (0 deg is pointing upwards)
+        azimuth : array of floats (in radians), shape (M,)
+            azimuth angles of the incoming signal/air-shower directions (0 deg is North, 90 deg is West)
+        inclination : float or array of floats (in radians), shape (M,)
+            Inclination of the magnetic field
+            The default value is given for GRAND's Dunhuang site
+        declination : float or array of floats (in radians), shape (M,)
+            Declination of the magnetic field
+            The default value is given for GRAND's Dunhuang site
+
+        magnetic_field_vector (optional): 3-vector or array of 3-vectors with shape (M, 3), default None
+            the magnetic field vectors in the cartesian ground coordinate system,
+            if no magnetic field vector is specified, the value is calculated from the given inclination
+            as in starshapes.py, i.e. (cos(inclination), 0, -sin(inclination)).
+
+        dtype (optional): numpy floating point type, default np.float64
+            precision in which tensors are transformed, see cstransform
+        """
+
+        self.dtype = np.dtype(dtype)
+
+        zenith = np.atleast_1d(np.asarray(zenith, dtype=float))
+        azimuth = np.atleast_1d(np.asarray(azimuth, dtype=float))
+        zenith, azimuth, inclination, declination = np.broadcast_arrays(
+            zenith, azimuth, np.asarray(inclination, dtype=float), np.asarray(declination, dtype=float))
+        n_geometries = len(zenith)
+        self.n_geometries = n_geometries
+
+        if magnetic_field_vector is None:
+            magnetic_field_vector = np.array([np.cos(inclination), np.zeros(n_geometries), -np.sin(inclination)]).T
+        magnetic_field_vector = np.broadcast_to(np.asarray(magnetic_field_vector, dtype=float), (n_geometries, 3))
+
+        self.zenith = zenith
+        self.azimuth = azimuth
+        self.inclination = inclination
+        self.declination = declination
+        self.magnetic_field_vector = magnetic_field_vector
+
+        # v points along shower propagation direction
+        showeraxis = -1 * spherical_to_cartesian(zenith, azimuth)  # -1 is because shower is propagating towards us
+
+        magnetic_field_normalized = magnetic_field_vector / linalg.norm(magnetic_field_vector, axis=-1)[:, np.newaxis]
+        e1 = np.cross(showeraxis, magnetic_field_normalized)
+        e2 = np.cross(showeraxis, e1)
+        e3 = np.cross(e1, e2)
+
+        e1 /= linalg.norm(e1, axis=-1)[:, np.newaxis]
+        e2 /= linalg.norm(e2, axis=-1)[:, np.newaxis]
+        e3 /= linalg.norm(e3, axis=-1)[:, np.newaxis]
+
+        self.__transformation_matrix_vBvvB = np.stack([e1, e2, e3], axis=1)
+        self.__inverse_transformation_matrix_vBvvB = self.__transformation_matrix_vBvvB.transpose(0, 2, 1)
+
+        # transformation matrices to on-sky coordinate system (er, etheta, ephi)
+        ct = np.cos(zenith) # cosinus theta
+        st = np.sin(zenith) # sinus theta
+        cp = np.cos(azimuth) # cosinus phi
+        sp = np.sin(azimuth) # sinus phi
+        e1 = np.array([st * cp, st * sp, ct]).T
+        e2 = np.array([ct * cp, ct * sp, -st]).T
+        e3 = np.array([-sp, cp, np.zeros(n_geometries)]).T
+        self.__transformation_matrix_onsky = np.stack([e1, e2, e3], axis=1)
+        self.__inverse_transformation_matrix_onsky = self.__transformation_matrix_onsky.transpose(0, 2, 1)
+
+        # transformation matrices from magnetic north to geographic north coordinate system
+        self.__transformation_matrix_magnetic = _stacked_rotation_z(-1 * declination)
+        self.__inverse_transformation_matrix_magnetic = self.__transformation_matrix_magnetic.transpose(0, 2, 1)
+
+        # transformation matrices from ground (geographic) cs to ground
+        # cs where x axis points into shower direction projected on ground
+        self.__transformation_matrix_azimuth = _stacked_rotation_z(-1 * azimuth)
+        self.__inverse_transformation_matrix_azimuth = self.__transformation_matrix_azimuth.transpose(0, 2, 1)
+
+        # transformation matrices from ground (geographic) cs to shower plane (early-late) cs
+        # rotation along z axis -> shower axis along y axis
+        rotation_z = _stacked_rotation_z(-azimuth + np.pi / 2)
+
+        # rotation along x axis -> rotation in shower plane
+        c = np.cos(zenith)
+        s = np.sin(zenith)
+        rotation_x = np.zeros((n_geometries, 3, 3))
+        rotation_x[:, 0, 0] = 1
+        rotation_x[:, 1, 1] = c
+        rotation_x[:, 1, 2] = -s
+        rotation_x[:, 2, 1] = s
+        rotation_x[:, 2, 2] = c
+
+        self.__transformation_matrix_early_late = np.matmul(rotation_x, rotation_z)
+        self.__inverse_transformation_matrix_early_late = self.__transformation_matrix_early_late.transpose(0, 2, 1)
+
+
+
+    def __transform(self, positions, matrices, core=None, add_core=False, out=None):
+        """ apply stacked matrices (M, 3, 3) to a tensor of shape (M, ..., 3) or (1, ..., 3)
+        with a single batched matrix product.
+
+        If `core` (shape (3,) or (M, 3)) is given, it is subtracted from the positions before
+        the transformation (add_core=False) or added afterwards (add_core=True).
+        """
+        positions = np.asarray(positions, dtype=self.dtype)
+        matrices = matrices.astype(self.dtype, copy=False)
+        if positions.ndim < 2 or positions.shape[-1] != 3:
+            sys.exit("Illegal position given, expected a tensor of shape (M, ..., 3)")
+
+        # reshape core such that it broadcasts over all inner dimensions: (M, 1, ..., 1, 3)
+        if core is not None:
+            core = np.asarray(core, dtype=self.dtype)
+            if core.ndim == 2:
+                core = core.reshape((core.shape[0],) + (1,) * (positions.ndim - 2) + (3,))
+
+        if core is not None and not add_core:
+            positions = positions - core
+
+        # (M, ..., 3) -> (M, K, 3) for a single batched matrix product
+        shape = positions.shape
+        flat = positions.reshape(shape[0], -1, 3)
+        result_shape = (max(shape[0], self.n_geometries),) + shape[1:]
+
+        if out is not None:
+            np.matmul(flat, matrices.transpose(0, 2, 1), out=out.reshape(result_shape[0], -1, 3))
+            result = out
+        else:
+            result = np.matmul(flat, matrices.transpose(0, 2, 1)).reshape(result_shape)
+
+        if core is not None and add_core:
+            result += core
+
+        return result
+
+    def transform_from_ground_to_onsky(self, positions):
+        """ on sky coordinates are eR, eTheta, ePhi """
+        return self.__transform(positions, self.__transformation_matrix_onsky)
+
+    def transform_from_onsky_to_ground(self, positions):
+        """ on sky coordinates are eR, eTheta, ePhi """
+        return self.__transform(positions, self.__inverse_transformation_matrix_onsky)
+
+    def transform_from_magnetic_to_geographic(self, positions):
+        return self.__transform(positions, self.__transformation_matrix_magnetic)
+
+    def transform_from_geographic_to_magnetic(self, positions):
+        return self.__transform(positions, self.__inverse_transformation_matrix_magnetic)
+
+    def transform_from_azimuth_to_geographic(self, positions):
+        return self.__transform(positions, self.__transformation_matrix_azimuth)
+
+    def transform_from_geographic_to_azimuth(self, positions):
+        return self.__transform(positions, self.__inverse_transformation_matrix_azimuth)
+
+    def transform_to_vxB_vxvxB(self, positions, core=None, out=None):
+        """ transform position or trace tensors (M, ..., 3) into the vxB, vxvxB shower planes """
+        return self.__transform(positions, self.__transformation_matrix_vBvvB, core=core, out=out)
+
+    def transform_from_vxB_vxvxB(self, positions, core=None, out=None):
+        """ transform position or trace tensors (M, ..., 3) from the vxB, vxvxB shower planes back to x,y,z CS """
+        return self.__transform(positions, self.__inverse_transformation_matrix_vBvvB, core=core, add_core=True, out=out)
+
+    def transform_to_early_late(self, positions, core=None, out=None):
+        """ transform position tensors (M, ..., 3) into the shower plane (early-late) systems """
+        return self.__transform(positions, self.__transformation_matrix_early_late, core=core, out=out)
+
+    def transform_from_early_late(self, positions, core=None, out=None):
+        """ transform position tensors (M, ..., 3) from the shower plane (early-late) systems back to x,y,z CS """
+        return self.__transform(positions, self.__inverse_transformation_matrix_early_late, core=core, add_core=True, out=out)
+
+
+
+    def get_euler_angles(self):
+        """ Euler angles (psi, theta, phi) of the vxB transformation matrices for all geometries,
+        see cstransform.get_euler_angles. Returns three arrays with the shape (M,). """
+        R = self.__transformation_matrix_vBvvB
+
+        # general case
+        with np.errstate(divide="ignore", invalid="ignore"):
+            theta = -np.arcsin(np.clip(R[:, 2, 0], -1, 1))
+            cos_theta = np.cos(theta)
+            psi = np.arctan2(R[:, 2, 1] / cos_theta, R[:, 2, 2] / cos_theta)
+            phi = np.arctan2(R[:, 1, 0] / cos_theta, R[:, 0, 0] / cos_theta)
+
+        # gimbal lock: R[2, 0] = -1 or 1
+        mask_down = R[:, 2, 0] == -1
+        mask_up = R[:, 2, 0] == 1
+        phi = np.where(mask_down | mask_up, 0., phi)
+        theta = np.where(mask_down, math.pi * 0.5, np.where(mask_up, -1. * math.pi * 0.5, theta))
+        psi = np.where(mask_down, np.arctan2(R[:, 0, 1], R[:, 0, 2]),
+                       np.where(mask_up, np.arctan2(-R[:, 0, 1], -R[:, 0, 2]), psi))
+
+        return psi, theta, phi
+
+
+
+    def get_transformation_matrices(self):
+        """ Returns the stacked (M, 3, 3) transformation matrices into the vxB, early-late and on-sky systems """
+        return (self.__transformation_matrix_vBvvB, self.__transformation_matrix_early_late,
+                self.__transformation_matrix_onsky)
+
+
+
+    def save(self, filename, dtype=np.float64):
+        """ Saves the geometries, the Euler angles and the vxB, early-late and on-sky matrices
+        of all geometries into a compressed numpy file (.npz).
+
+        The arrays are stored with the given dtype (e.g. np.float32 for a more compact file).
+        Load them with np.load(filename).
+        """
+        psi, theta, phi = self.get_euler_angles()
+        vxB, early_late, onsky = self.get_transformation_matrices()
+        arrays = dict(zenith=self.zenith, azimuth=self.azimuth, inclination=self.inclination,
+                      declination=self.declination, magnetic_field_vector=self.magnetic_field_vector,
+                      euler_angles=np.stack([psi, theta, phi], axis=-1),
+                      matrix_vxB_vxvxB=vxB, matrix_early_late=early_late, matrix_onsky=onsky)
+        np.savez_compressed(filename, **{key: np.asarray(value, dtype=dtype) for key, value in arrays.items()})